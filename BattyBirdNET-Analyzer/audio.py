@@ -1,6 +1,7 @@
 """Module containing audio helper functions.
 """
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 
 import config as cfg
 
@@ -29,6 +30,46 @@ def openAudioFile(path: str, sample_rate=cfg.SAMPLE_RATE, offset=0.0, duration=N
     return sig, rate
 
 
+def openAudioStream(path: str, sample_rate=cfg.SAMPLE_RATE, block_seconds=10.0):
+    """Open an audio file for streaming.
+
+    Reads the file block by block with soundfile and resamples each block with a
+    soxr stream, which keeps the filter state across block boundaries. Only one
+    block of the file is held in memory at a time.
+
+    Args:
+        path: Path to the audio file.
+        sample_rate: The sample rate at which the file should be processed.
+        block_seconds: The duration of the blocks read from the file.
+
+    Returns:
+        A generator of mono float32 blocks at sample_rate.
+
+    Raises:
+        ImportError: soxr is not installed.
+        RuntimeError: soundfile cannot read the file format.
+    """
+    import soundfile as sf
+    import soxr
+
+    sfile = sf.SoundFile(path)
+    resampler = None
+    if sfile.samplerate != sample_rate:
+        resampler = soxr.ResampleStream(sfile.samplerate, sample_rate, 1, dtype="float32")
+
+    def blocks():
+        with sfile:
+            for block in sfile.blocks(blocksize=int(block_seconds * sfile.samplerate), dtype="float32", always_2d=True):
+                block = block.mean(axis=1, dtype="float32") if block.shape[1] > 1 else block[:, 0]
+                yield resampler.resample_chunk(block) if resampler else block
+
+            # Flush the samples still held back by the resampling filter
+            if resampler:
+                yield resampler.resample_chunk(np.zeros(0, dtype="float32"), last=True)
+
+    return blocks()
+
+
 def saveSignal(sig, fname: str):
     """Saves a signal to file.
 
@@ -67,6 +108,30 @@ def noise(sig, shape, amount=None):
     return noise.astype("float32")
 
 
+def padTail(tail, window, hop, minlen):
+    """Pads the end of a signal for the splits that reach past it.
+
+    The tail is padded once with noise, long enough for every split that
+    starts in it and is at least minlen samples long.
+
+    Args:
+        tail: The signal from the start of the first split that reaches past its end.
+        window: The length of a split in samples.
+        hop: The distance between split starts in samples.
+        minlen: Minimum length of a split in samples.
+
+    Returns:
+        A 2D array of the padded splits, which may be empty.
+    """
+    num_splits = len(range(0, max(0, len(tail) - max(minlen, 1) + 1), hop))
+    if num_splits == 0:
+        return np.zeros((0, window), dtype="float32")
+
+    padded = np.hstack((tail, noise(tail, (num_splits - 1) * hop + window - len(tail), 0.5)))
+
+    return sliding_window_view(padded, window)[::hop]
+
+
 def splitSignal(sig, rate, seconds, overlap, minlen):
     """Split signal with overlap.
 
@@ -78,24 +143,53 @@ def splitSignal(sig, rate, seconds, overlap, minlen):
         minlen: Minimum length of a split.
     
     Returns:
-        A list of splits.
+        A 2D array of splits. Without a padded tail this is a strided view of sig.
     """
-    sig_splits = []
+    window = int(seconds * rate)
+    hop = int((seconds - overlap) * rate)
+
+    # Splits that fit into the signal
+    sig_splits = sliding_window_view(sig, window)[::hop] if len(sig) >= window else sig[:0].reshape(0, window)
+    tail = padTail(sig[len(sig_splits) * hop :], window, hop, int(minlen * rate))
 
-    for i in range(0, len(sig), int((seconds - overlap) * rate)):
-        split = sig[i : i + int(seconds * rate)]
+    if len(tail) == 0:
+        return sig_splits
 
-        # End of signal?
-        if len(split) < int(minlen * rate):
-            break
+    return np.concatenate((sig_splits, tail.astype(sig_splits.dtype)))
 
-        # Signal chunk too short?
-        if len(split) < int(rate * seconds):
-            split = np.hstack((split, noise(split, (int(rate * seconds) - len(split)), 0.5)))
 
-        sig_splits.append(split)
+def splitSignalStream(blocks, rate, seconds, overlap, minlen):
+    """Split a stream of signal blocks with overlap.
 
-    return sig_splits
+    Yields the same chunks as splitSignal, without holding more than one chunk
+    and one block of the signal in memory. Chunks are strided views of the buffered signal.
+
+    Args:
+        blocks: An iterable of consecutive signal blocks, e.g. from openAudioStream.
+        rate: The sampling rate.
+        seconds: The duration of a segment.
+        overlap: The overlapping seconds of segments.
+        minlen: Minimum length of a split.
+
+    Yields:
+        The splits of the signal.
+    """
+    window = int(seconds * rate)
+    hop = int((seconds - overlap) * rate)
+    # The signal from the start of the next split on
+    buffer = np.zeros(0, dtype="float32")
+
+    for block in blocks:
+        buffer = np.concatenate((buffer, block))
+        if len(buffer) < window:
+            continue
+
+        splits = sliding_window_view(buffer, window)[::hop]
+        yield from splits
+        buffer = buffer[len(splits) * hop :]
+
+    # Splits reaching past the end of the signal
+    yield from padTail(buffer, window, hop, int(minlen * rate))
 
 
 def cropCenter(sig, rate, seconds):
@@ -2,8 +2,8 @@
 """
 import argparse
 import datetime
+import itertools
 import json
-import operator
 import os
 import sys
 from multiprocessing import Pool, freeze_support
@@ -26,10 +26,57 @@ def load_codes():
         codes = json.load(cfile)
     return codes
 
-def save_result_file(r: dict[str, list], path: str, afile_path: str):
+def get_label_columns():
+    """Precomputes the output columns of every label.
+    Returns:
+        A dictionary of arrays indexed like cfg.LABELS, holding the species code,
+        scientific name, common name and translated label of each label, and
+        whether the label passes the species list.
+    """
+    # The first occurrence of a label is the one that is translated
+    first_index = {}
+    for i, label in enumerate(cfg.LABELS):
+        first_index.setdefault(label, i)
+    translated = [cfg.TRANSLATED_LABELS[first_index[label]] for label in cfg.LABELS]
+    species_list = set(cfg.SPECIES_LIST)
+
+    return {
+        "code": np.array([cfg.CODES[label] if label in cfg.CODES else label for label in cfg.LABELS], dtype=object),
+        "scientific": np.array([label.split("_", 1)[0] for label in translated], dtype=object),
+        "common": np.array([label.split("_", 1)[-1] for label in translated], dtype=object),
+        "translated": np.array(translated, dtype=object),
+        "allowed": np.array([not species_list or label in species_list for label in cfg.LABELS], dtype=bool),
+    }
+
+
+def get_detections(timestamps: list, scores: np.ndarray):
+    """Selects the detections above the confidence threshold.
+    Args:
+        timestamps: The (start, end) of each chunk.
+        scores: The prediction scores, one row per chunk and one column per label.
+    Returns:
+        The start and end strings, label indices and confidences of every detection,
+        ordered by chunk and by descending confidence within a chunk.
+    """
+    labels = get_label_columns()
+    chunks, label_indices = np.nonzero((scores > cfg.MIN_CONFIDENCE) & labels["allowed"])
+    confidences = scores[chunks, label_indices]
+
+    # Highest confidence first within each chunk; ties keep the label order
+    order = np.lexsort((-confidences, chunks))
+    chunks, label_indices, confidences = chunks[order], label_indices[order], confidences[order]
+
+    starts = np.array([str(start) for start, _ in timestamps], dtype=object)
+    ends = np.array([str(end) for _, end in timestamps], dtype=object)
+
+    return labels, starts[chunks], ends[chunks], label_indices, confidences.tolist()
+
+
+def save_result_file(timestamps: list, scores: np.ndarray, path: str, afile_path: str):
     """Saves the results to the hard drive.
     Args:
-        r: The dictionary with {segment: scores}.
+        timestamps: The (start, end) of each chunk.
+        scores: The prediction scores, one row per chunk and one column per label.
         path: The path where the result should be saved.
         afile_path: The path to audio file.
     """
@@ -37,138 +84,71 @@ def save_result_file(r: dict[str, list], path: str, afile_path: str):
     if os.path.dirname(path):
         os.makedirs(os.path.dirname(path), exist_ok=True)
 
-    # Selection table
-    out_string = ""
+    labels, starts, ends, label_indices, confidences = get_detections(timestamps, scores)
+    detections = zip(starts, ends, labels["code"][label_indices], labels["scientific"][label_indices],
+                     labels["common"][label_indices], labels["translated"][label_indices], confidences)
+    rows = []
 
     if cfg.RESULT_TYPE == "table":
         # Raven selection header
-        header = "Selection\tView\tChannel\tBegin Time (s)\tEnd Time (s)\tSpecies Code\tCommon Name\tConfidence\n"
-        selection_id = 0
-        # Write header
-        out_string += header
-
-        # Extract valid predictions for every timestamp
-        for timestamp in get_sorted_timestamps(r):
-            rstring = ""
-            start, end = timestamp.split("-", 1)
-
-            for c in r[timestamp]:
-                if c[1] > cfg.MIN_CONFIDENCE and (not cfg.SPECIES_LIST or c[0] in cfg.SPECIES_LIST):
-                    selection_id += 1
-                    label = cfg.TRANSLATED_LABELS[cfg.LABELS.index(c[0])]
-                    rstring += "{}\tSpectrogram 1\t1\t{}\t{}\t{}\t{}\t{:.4f}\n".format(
-                        selection_id,
-                        start,
-                        end,
-                        cfg.CODES[c[0]] if c[0] in cfg.CODES else c[0],
-                        label.split("_", 1)[-1],
-                        c[1],
-                    )
-
-            # Write result string to file
-            out_string += rstring
+        rows.append("Selection\tView\tChannel\tBegin Time (s)\tEnd Time (s)\tSpecies Code\tCommon Name\tConfidence\n")
+
+        for selection_id, (start, end, code, _, common, _, confidence) in enumerate(detections, 1):
+            rows.append("{}\tSpectrogram 1\t1\t{}\t{}\t{}\t{}\t{:.4f}\n".format(
+                selection_id, start, end, code, common, confidence))
 
     elif cfg.RESULT_TYPE == "audacity":
         # Audacity timeline labels
-        for timestamp in get_sorted_timestamps(r):
-            rstring = ""
-
-            for c in r[timestamp]:
-                if c[1] > cfg.MIN_CONFIDENCE and (not cfg.SPECIES_LIST or c[0] in cfg.SPECIES_LIST):
-                    label = cfg.TRANSLATED_LABELS[cfg.LABELS.index(c[0])]
-                    rstring += "{}\t{}\t{:.4f}\n".format(timestamp.replace("-", "\t"), label.replace("_", ", "), c[1])
-
-            # Write result string to file
-            out_string += rstring
+        for start, end, _, _, _, label, confidence in detections:
+            rows.append("{}\t{}\t{}\t{:.4f}\n".format(start, end, label.replace("_", ", "), confidence))
 
     elif cfg.RESULT_TYPE == "r":
         # Output format for R
-        header = ("filepath,start,end,scientific_name,common_name,confidence,lat,lon,week,"
-                  "overlap,sensitivity,min_conf,species_list,model")
-        out_string += header
-
-        for timestamp in get_sorted_timestamps(r):
-            rstring = ""
-            start, end = timestamp.split("-", 1)
-
-            for c in r[timestamp]:
-                if c[1] > cfg.MIN_CONFIDENCE and (not cfg.SPECIES_LIST or c[0] in cfg.SPECIES_LIST):
-                    label = cfg.TRANSLATED_LABELS[cfg.LABELS.index(c[0])]
-                    rstring += "\n{},{},{},{},{},{:.4f},{:.4f},{:.4f},{},{},{},{},{},{}".format(
-                        afile_path,
-                        start,
-                        end,
-                        label.split("_", 1)[0],
-                        label.split("_", 1)[-1],
-                        c[1],
-                        cfg.LATITUDE,
-                        cfg.LONGITUDE,
-                        cfg.WEEK,
-                        cfg.SIG_OVERLAP,
-                        (1.0 - cfg.SIGMOID_SENSITIVITY) + 1.0,
-                        cfg.MIN_CONFIDENCE,
-                        cfg.SPECIES_LIST_FILE,
-                        os.path.basename(cfg.MODEL_PATH),
-                    )
-
-            # Write result string to file
-            out_string += rstring
+        rows.append("filepath,start,end,scientific_name,common_name,confidence,lat,lon,week,"
+                    "overlap,sensitivity,min_conf,species_list,model")
+        run_columns = "{:.4f},{:.4f},{},{},{},{},{},{}".format(
+            cfg.LATITUDE,
+            cfg.LONGITUDE,
+            cfg.WEEK,
+            cfg.SIG_OVERLAP,
+            (1.0 - cfg.SIGMOID_SENSITIVITY) + 1.0,
+            cfg.MIN_CONFIDENCE,
+            cfg.SPECIES_LIST_FILE,
+            os.path.basename(cfg.MODEL_PATH),
+        )
+
+        for start, end, _, scientific, common, _, confidence in detections:
+            rows.append("\n{},{},{},{},{},{:.4f},{}".format(
+                afile_path, start, end, scientific, common, confidence, run_columns))
 
     elif cfg.RESULT_TYPE == "kaleidoscope":
         # Output format for kaleidoscope
-        header = ("INDIR,FOLDER,IN FILE,OFFSET,DURATION,scientific_name,"
-                  "common_name,confidence,lat,lon,week,overlap,sensitivity")
-        out_string += header
+        rows.append("INDIR,FOLDER,IN FILE,OFFSET,DURATION,scientific_name,"
+                    "common_name,confidence,lat,lon,week,overlap,sensitivity")
 
         folder_path, filename = os.path.split(afile_path)
         parent_folder, folder_name = os.path.split(folder_path)
-
-        for timestamp in get_sorted_timestamps(r):
-            rstring = ""
-            start, end = timestamp.split("-", 1)
-
-            for c in r[timestamp]:
-                if c[1] > cfg.MIN_CONFIDENCE and (not cfg.SPECIES_LIST or c[0] in cfg.SPECIES_LIST):
-                    label = cfg.TRANSLATED_LABELS[cfg.LABELS.index(c[0])]
-                    rstring += "\n{},{},{},{},{},{},{},{:.4f},{:.4f},{:.4f},{},{},{}".format(
-                        parent_folder.rstrip("/"),
-                        folder_name,
-                        filename,
-                        start,
-                        float(end) - float(start),
-                        label.split("_", 1)[0],
-                        label.split("_", 1)[-1],
-                        c[1],
-                        cfg.LATITUDE,
-                        cfg.LONGITUDE,
-                        cfg.WEEK,
-                        cfg.SIG_OVERLAP,
-                        (1.0 - cfg.SIGMOID_SENSITIVITY) + 1.0,
-                    )
-
-            # Write result string to file
-            out_string += rstring
+        run_columns = "{:.4f},{:.4f},{},{},{}".format(
+            cfg.LATITUDE,
+            cfg.LONGITUDE,
+            cfg.WEEK,
+            cfg.SIG_OVERLAP,
+            (1.0 - cfg.SIGMOID_SENSITIVITY) + 1.0,
+        )
+
+        for start, end, _, scientific, common, _, confidence in detections:
+            rows.append("\n{},{},{},{},{},{},{},{:.4f},{}".format(
+                parent_folder.rstrip("/"), folder_name, filename, start,
+                float(end) - float(start), scientific, common, confidence, run_columns))
 
     else:
         # CSV output file
-        header = "Start (s),End (s),Scientific name,Common name,Confidence\n"
-
-        # Write header
-        out_string += header
+        rows.append("Start (s),End (s),Scientific name,Common name,Confidence\n")
 
-        for timestamp in get_sorted_timestamps(r):
-            rstring = ""
+        for start, end, _, scientific, common, _, confidence in detections:
+            rows.append("{},{},{},{},{:.4f}\n".format(start, end, scientific, common, confidence))
 
-            for c in r[timestamp]:
-                start, end = timestamp.split("-", 1)
-
-                if c[1] > cfg.MIN_CONFIDENCE and (not cfg.SPECIES_LIST or c[0] in cfg.SPECIES_LIST):
-                    label = cfg.TRANSLATED_LABELS[cfg.LABELS.index(c[0])]
-                    rstring += "{},{},{},{},{:.4f}\n".format(start, end, label.split("_", 1)[0],
-                                                             label.split("_", 1)[-1], c[1])
-
-            # Write result string to file
-            out_string += rstring
+    out_string = "".join(rows)
 
     # Save as file
     with open(path, "w", encoding="utf-8") as rfile:
@@ -176,29 +156,25 @@ def save_result_file(r: dict[str, list], path: str, afile_path: str):
     return out_string
 
 
-def get_sorted_timestamps(results: dict[str, list]):
-    """Sorts the results based on the segments.
-    Args:
-        results: The dictionary with {segment: scores}.
-    Returns:
-        Returns the sorted list of segments and their scores.
-    """
-    return sorted(results, key=lambda t: float(t.split("-", 1)[0]))
-
-
 def get_raw_audio_from_file(fpath: str):
     """Reads an audio file.
-    Reads the file and splits the signal into chunks.
+    Streams the file in blocks and splits the signal into chunks on the fly.
+    Files soundfile cannot read are loaded whole with librosa instead.
     Args:
         fpath: Path to the audio file.
     Returns:
-        The signal split into a list of chunks.
+        An iterator over the chunks of the signal.
     """
-    # Open file
-    sig, rate = audio.openAudioFile(fpath, cfg.SAMPLE_RATE)
+    try:
+        # Open file as a stream of resampled blocks
+        blocks = audio.openAudioStream(fpath, cfg.SAMPLE_RATE)
+        rate = cfg.SAMPLE_RATE
+    except (ImportError, RuntimeError):
+        sig, rate = audio.openAudioFile(fpath, cfg.SAMPLE_RATE)
+        blocks = [sig]
 
     # Split into raw audio chunks
-    chunks = audio.splitSignal(sig, rate, cfg.SIG_LENGTH, cfg.SIG_OVERLAP, cfg.SIG_MINLEN)
+    chunks = audio.splitSignalStream(blocks, rate, cfg.SIG_LENGTH, cfg.SIG_OVERLAP, cfg.SIG_MINLEN)
 
     return chunks
 
@@ -212,8 +188,8 @@ def predict(samples):
     Returns:
         The prediction scores.
     """
-    # Prepare sample and pass through model
-    data = np.array(samples, dtype="float32")
+    # Prepare sample and pass through model; a contiguous float32 batch is used as is
+    data = np.ascontiguousarray(samples, dtype="float32")
     prediction = model.predict(data)
 
     # Logits or sigmoid activations?
@@ -232,7 +208,8 @@ def analyze_file(item):
         item: Tuple containing (file path, config)
 
     Returns:
-        The `True` if the file was analyzed successfully.
+        The block of the file in the combined results and its detections,
+        or `False` if the file could not be analyzed.
     """
     # Get file path and restore cfg
     fpath: str = item[0]
@@ -258,46 +235,32 @@ def analyze_file(item):
     # Process each chunk
     try:
         start, end = 0, cfg.SIG_LENGTH
-        results = {}
+        scores = []
         samples = []
         timestamps = []
 
-        for chunk_index, chunk in enumerate(chunks):
-            # Add to batch
-            samples.append(chunk)
-            timestamps.append([start, end])
+        # The last batch is flushed by the trailing None
+        for chunk in itertools.chain(chunks, [None]):
+            if chunk is not None:
+                # Add to batch
+                samples.append(chunk)
+                timestamps.append((start, end))
 
-            # Advance start and end
-            start += cfg.SIG_LENGTH - cfg.SIG_OVERLAP
-            end = start + cfg.SIG_LENGTH
+                # Advance start and end
+                start += cfg.SIG_LENGTH - cfg.SIG_OVERLAP
+                end = start + cfg.SIG_LENGTH
 
             # Check if batch is full or last chunk
-            if len(samples) < cfg.BATCH_SIZE and chunk_index < len(chunks) - 1:
+            if not samples or (len(samples) < cfg.BATCH_SIZE and chunk is not None):
                 continue
 
-            # Predict
-            prediction = predict(samples)
-
-            # Add to results
-            for i in range(len(samples)):
-                # Get timestamp
-                s_start, s_end = timestamps[i]
-
-                # Get prediction
-                pred = prediction[i]
-
-                # Assign scores to labels
-                p_labels = zip(cfg.LABELS, pred)
-
-                # Sort by score
-                p_sorted = sorted(p_labels, key=operator.itemgetter(1), reverse=True)
-
-                # Store top 5 results and advance indices
-                results[str(s_start) + "-" + str(s_end)] = p_sorted
+            # Predict and keep the scores of the batch
+            scores.append(np.asarray(predict(samples)))
 
             # Clear batch
             samples = []
-            timestamps = []
+
+        scores = np.concatenate(scores) if scores else np.zeros((0, len(cfg.LABELS)), dtype="float32")
 
     except Exception as ex:
         # Write error log
@@ -324,15 +287,23 @@ def analyze_file(item):
             else:
                 rtype = ".bat.results.csv"
 
-            out_string = save_result_file(results, os.path.join(cfg.OUTPUT_PATH, rpath.rsplit(".", 1)[0] + rtype), fpath)
+            out_string = save_result_file(timestamps, scores, os.path.join(cfg.OUTPUT_PATH, rpath.rsplit(".", 1)[0] + rtype), fpath)
         else:
-            out_string = save_result_file(results, cfg.OUTPUT_PATH, fpath)
-            # Save as file
-        with open(cfg.OUTPUT_PATH + "Results.csv", "a", encoding="utf-8") as rfile:
-            postString = out_string.split("\n", 1)[1]
-            # rfile.write(fpath.join(postString.splitlines(True)))
-            rfile.write("\n"+fpath+"\n")
-            rfile.write(postString)
+            out_string = save_result_file(timestamps, scores, cfg.OUTPUT_PATH, fpath)
+
+        # The block of this file in the combined results, written by the parent process
+        postString = out_string.split("\n", 1)[1] if "\n" in out_string else ""
+        combined = "\n" + fpath + "\n" + postString
+        _, starts, ends, label_indices, confidences = get_detections(timestamps, scores)
+        labels = get_label_columns()
+        detections = {
+            "file": [fpath] * len(confidences),
+            "start": [float(start) for start in starts],
+            "end": [float(end) for end in ends],
+            "scientific_name": labels["scientific"][label_indices].tolist(),
+            "common_name": labels["common"][label_indices].tolist(),
+            "confidence": confidences,
+        }
 
     except Exception as ex:
         # Write error log
@@ -342,7 +313,41 @@ def analyze_file(item):
 
     delta_time = (datetime.datetime.now() - start_time).total_seconds()
     print("Finished {} in {:.2f} seconds".format(fpath, delta_time), flush=True)
-    return True
+    return combined, detections
+
+
+def write_combined_results(results, path: str, parquet_path: str = None):
+    """Writes the results of all files to the combined result files.
+    Runs in the parent process only, so workers never write to the same file.
+    Args:
+        results: The return values of analyze_file, in file order.
+        path: The combined text file; file blocks are appended to it.
+        parquet_path: If set, all detections are also written to this Parquet file.
+    """
+    parquet_writer = None
+    if parquet_path:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        schema = pa.schema([("file", pa.string()), ("start", pa.float64()), ("end", pa.float64()),
+                            ("scientific_name", pa.string()), ("common_name", pa.string()),
+                            ("confidence", pa.float64())])
+        parquet_writer = pq.ParquetWriter(parquet_path, schema)
+
+    try:
+        with open(path, "a", encoding="utf-8", buffering=1024 * 1024) as rfile:
+            for result in results:
+                # Files that could not be analyzed
+                if not result:
+                    continue
+
+                combined, detections = result
+                rfile.write(combined)
+                if parquet_writer:
+                    parquet_writer.write_table(pa.table(detections, schema=schema))
+    finally:
+        if parquet_writer:
+            parquet_writer.close()
 
 def set_analysis_location(kHz = 256):
 
@@ -538,6 +543,11 @@ def add_parser_arguments():
                         default="off",
                         help="Generate mel spectrograms files containing the detected segments. "
                         )
+    parser.add_argument("--combined_parquet",
+                        default="off",
+                        help="Also write the detections of all files to Results.parquet next to Results.csv. "
+                             "Values in [off, on]. Defaults to off."
+                        )
     parser.add_argument("--noisered",
                         default="off",
                         help="Reduce the microphone specific noise in visualized spectrum."
@@ -549,6 +559,10 @@ def add_parser_arguments():
     parser.add_argument("--o",
                         default=cfg.OUTPUT_PATH_SAMPLES,
                         help="Path to output file or folder. If this is a file, --i needs to be a file too.")
+    parser.add_argument("--file_list",
+                        default=None,
+                        help="Path to a text file listing the audio files to analyze, one per line. "
+                             "Relative paths are taken from --i. Defaults to all audio files in --i.")
 
     parser.add_argument("--classifier",
                         default=None,
@@ -606,7 +620,11 @@ def load_species_list():
         print(f"Species list contains {len(cfg.SPECIES_LIST)} species")
 
 def parse_input_files():
-    if os.path.isdir(cfg.INPUT_PATH):
+    if args.file_list:
+        cfg.FILE_LIST = [f if os.path.isabs(f) else os.path.join(cfg.INPUT_PATH, f) for f in utils.readLines(args.file_list)]
+        cfg.FILE_LIST = [f for f in cfg.FILE_LIST if os.path.isfile(f)]
+        print(f"Found {len(cfg.FILE_LIST)} listed files to analyze")
+    elif os.path.isdir(cfg.INPUT_PATH):
         cfg.FILE_LIST = utils.collect_audio_files(cfg.INPUT_PATH)
         print(f"Found {len(cfg.FILE_LIST)} files to analyze")
     else:
@@ -663,13 +681,14 @@ if __name__ == "__main__":
     # have its own config. USE LINUX!
     flist = [(f, cfg.get_config()) for f in cfg.FILE_LIST]
 
-    # Analyze files
+    # Analyze files; results come back in file order and are written here only
+    combined_path = cfg.OUTPUT_PATH + "Results.csv"
+    parquet_path = cfg.OUTPUT_PATH + "Results.parquet" if args.combined_parquet == "on" else None
     if cfg.CPU_THREADS < 2:
-        for entry in flist:
-            analyze_file(entry)
+        write_combined_results(map(analyze_file, flist), combined_path, parquet_path)
     else:
         with Pool(cfg.CPU_THREADS) as p:
-            p.map(analyze_file, flist)
+            write_combined_results(p.imap(analyze_file, flist), combined_path, parquet_path)
 
     if args.segment == "on" or args.spectrum == "on":
         script_dir = os.path.dirname(os.path.abspath(sys.argv[0]))
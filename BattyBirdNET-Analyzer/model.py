@@ -59,6 +59,9 @@ def loadModel(class_output=True):
         else:
             OUTPUT_LAYER_INDEX = output_details[0]["index"] - 1
 
+        # Allocate once for full batches
+        resizeInput(INTERPRETER, INPUT_LAYER_INDEX, [cfg.BATCH_SIZE, *input_details[0]["shape"][1:]])
+
     else:
         # Load protobuf model
         # Note: This will throw a bunch of warnings about custom gradients
@@ -86,6 +89,9 @@ def loadCustomClassifier():
     # Get classification output
     C_OUTPUT_LAYER_INDEX = output_details[0]["index"]
 
+    # Allocate once for full batches
+    resizeInput(C_INTERPRETER, C_INPUT_LAYER_INDEX, [cfg.BATCH_SIZE, *input_details[0]["shape"][1:]])
+
 
 def loadMetaModel():
     """Loads the model for species prediction.
@@ -109,6 +115,49 @@ def loadMetaModel():
     M_OUTPUT_LAYER_INDEX = output_details[0]["index"]
 
 
+def resizeInput(interpreter, input_index, shape):
+    """Resizes the input of an interpreter.
+
+    Tensors are only re-allocated if the shape differs from the current one.
+
+    Args:
+        interpreter: The TFLite interpreter.
+        input_index: The index of the input tensor.
+        shape: The new input shape.
+    """
+    if list(interpreter.get_input_details()[0]["shape"]) != list(shape):
+        interpreter.resize_tensor_input(input_index, shape)
+        interpreter.allocate_tensors()
+
+
+def setBatchInput(interpreter, input_index, sample):
+    """Sets a batch as input of an interpreter.
+
+    Batches smaller than cfg.BATCH_SIZE (the last one of a file) are padded
+    with zeros, so the interpreter keeps its allocated shape.
+
+    Args:
+        interpreter: The TFLite interpreter.
+        input_index: The index of the input tensor.
+        sample: The batch as float32 array.
+
+    Returns:
+        The number of rows of the input that belong to the batch.
+    """
+    sample = np.ascontiguousarray(sample, dtype="float32")
+    num_rows = len(sample)
+    batch_size = max(cfg.BATCH_SIZE, num_rows)
+    resizeInput(interpreter, input_index, [batch_size, *sample.shape[1:]])
+
+    if num_rows < batch_size:
+        padding = np.zeros((batch_size - num_rows, *sample.shape[1:]), dtype="float32")
+        sample = np.concatenate((sample, padding))
+
+    interpreter.set_tensor(input_index, sample)
+
+    return num_rows
+
+
 def buildLinearClassifier(num_labels, input_size, hidden_units=0):
     """Builds a classifier.
 
@@ -314,14 +363,12 @@ def predict(sample):
         loadModel()
 
     if PBMODEL == None:
-        # Reshape input tensor
-        INTERPRETER.resize_tensor_input(INPUT_LAYER_INDEX, [len(sample), *sample[0].shape])
-        INTERPRETER.allocate_tensors()
-
         # Make a prediction (Audio only for now)
-        INTERPRETER.set_tensor(INPUT_LAYER_INDEX, np.array(sample, dtype="float32"))
+        num_rows = setBatchInput(INTERPRETER, INPUT_LAYER_INDEX, sample)
         INTERPRETER.invoke()
-        prediction = INTERPRETER.get_tensor(OUTPUT_LAYER_INDEX)
+
+        # Drop the padding rows
+        prediction = INTERPRETER.get_tensor(OUTPUT_LAYER_INDEX)[:num_rows]
 
         return prediction
 
@@ -347,17 +394,25 @@ def predictWithCustomClassifier(sample):
     if C_INTERPRETER == None:
         loadCustomClassifier()
 
+    # Does interpreter exist?
+    if INTERPRETER == None:
+        loadModel(False)
+
     # Get embeddings
-    feature_vector = embeddings(sample)
+    num_rows = setBatchInput(INTERPRETER, INPUT_LAYER_INDEX, sample)
+    INTERPRETER.invoke()
 
-    # Reshape input tensor
-    C_INTERPRETER.resize_tensor_input(C_INPUT_LAYER_INDEX, [len(feature_vector), *feature_vector[0].shape])
-    C_INTERPRETER.allocate_tensors()
+    # Copy the embeddings, padding rows included, straight from the output
+    # buffer of the main model into the input buffer of the classifier.
+    # The views must not outlive this step, TFLite refuses to invoke otherwise.
+    feature_vector = INTERPRETER.tensor(OUTPUT_LAYER_INDEX)()
+    resizeInput(C_INTERPRETER, C_INPUT_LAYER_INDEX, feature_vector.shape)
+    C_INTERPRETER.tensor(C_INPUT_LAYER_INDEX)()[...] = feature_vector
+    del feature_vector
 
-    # Make a prediction
-    C_INTERPRETER.set_tensor(C_INPUT_LAYER_INDEX, np.array(feature_vector, dtype="float32"))
+    # Make a prediction and drop the padding rows
     C_INTERPRETER.invoke()
-    prediction = C_INTERPRETER.get_tensor(C_OUTPUT_LAYER_INDEX)
+    prediction = C_INTERPRETER.get_tensor(C_OUTPUT_LAYER_INDEX)[:num_rows]
 
     return prediction
 
@@ -377,13 +432,11 @@ def embeddings(sample):
     if INTERPRETER == None:
         loadModel(False)
 
-    # Reshape input tensor
-    INTERPRETER.resize_tensor_input(INPUT_LAYER_INDEX, [len(sample), *sample[0].shape])
-    INTERPRETER.allocate_tensors()
-
     # Extract feature embeddings
-    INTERPRETER.set_tensor(INPUT_LAYER_INDEX, np.array(sample, dtype="float32"))
+    num_rows = setBatchInput(INTERPRETER, INPUT_LAYER_INDEX, sample)
     INTERPRETER.invoke()
-    features = INTERPRETER.get_tensor(OUTPUT_LAYER_INDEX)
+
+    # Drop the padding rows
+    features = INTERPRETER.get_tensor(OUTPUT_LAYER_INDEX)[:num_rows]
 
     return features
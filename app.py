@@ -1,4 +1,8 @@
 import os
+import shutil
+import tempfile
+import threading
+import zipfile
 import streamlit as st
 import pandas as pd
 import numpy as np
@@ -6,265 +10,384 @@ import base64
 from PIL import Image 
 import plotly.express as px
 import plotly.graph_objects as go
-from datetime import datetime, timedelta
+from datetime import time, timedelta
+from itertools import islice
+from cachetools import LRUCache
+
+import result_store
+from result_schemas import get_result_model, count_rows
+from result_store import RESULT_CATALOG_NAME
 
 st.set_page_config(layout="wide")
 
+# Memory budget of the parsed result files kept in the ingest cache (shared by all sessions)
+INGEST_CACHE_MAX_BYTES = 512 * 1024 * 1024
 
-# Function to extract datetime from filename - Added for activity plot
-def extract_datetime_from_filename(filename):
-    """Extracts datetime from a filename in format: '*_20210603_034102.csv'"""
-    try:
-        filename = os.path.splitext(filename)[0]
-        parts = filename.split('_')
-        
-        # Identify the position of the date-time
-        for part in parts:
+# Rows (lines for text files) shown per page of the file preview
+PREVIEW_PAGE_ROWS = 500
 
-            # Extract only numeric characters
-            numeric_part = ''.join(filter(str.isdigit, part))
-            
-            if len(numeric_part) == 8:  # Date in YYYYMMDD format
-                date_str = numeric_part
-            if len(numeric_part) == 6:  # Time in HHMMSS format
-                time_str = numeric_part
-                break  # Stop once both date and time are found
-
-        # Parse date and time
-        if date_str and time_str:
-            return datetime.strptime(f"{date_str} {time_str}", "%Y%m%d %H%M%S")
-        
-        return None  # Fallback for unexpected cases
- 
-    except (IndexError, ValueError):
-        st.error("Filename format incorrect. Expected format: *_YYYYMMDD_HHMMSS.csv")
-        return None
-        
-# Function to safely read CSV files
-def safe_read_csv(file_path):
-    """Attempts to read a CSV file, skipping empty or invalid ones."""
+# Exports are built in memory up to this size and spill to a temporary file beyond it
+EXPORT_SPOOL_MAX_BYTES = 64 * 1024 * 1024
+EXPORT_COPY_CHUNK_BYTES = 1024 * 1024
+# st.download_button holds the whole archive in memory (even when given a file), so larger exports are refused
+EXPORT_MAX_BYTES = 512 * 1024 * 1024
+
+# Heatmaps are binned on the server to at most one cell per MIN_CELL_PIXELS of the figure
+HEATMAP_HEIGHT = 1200
+HEATMAP_MAX_WIDTH = 1000
+MIN_CELL_PIXELS = 4
+# Activity cube resolutions the heatmap can use, finest first, with their bin length in minutes
+HEATMAP_RESOLUTIONS = {'1min': 1, '10min': 10, '1h': 60}
+
+
+def load_result_file(file_path, model):
+    """Reads the columns of a model result CSV that the activity views need, in the result store's normalized schema.
+    Unreadable files (e.g. truncated or still being written) are skipped with a warning."""
     try:
-        if os.stat(file_path).st_size == 0:  # Check if file is empty
-            #st.warning(f"Skipping empty file: {file_path}")
-            return None
+        return result_store.normalize_result_file(file_path, model, view='activity')
+    except (OSError, ValueError, pd.errors.ParserError) as e:
+        # UnicodeDecodeError is a ValueError
+        st.warning(f"Skipping unreadable file {file_path}: {e}")
+        return pd.DataFrame()
 
-        df = pd.read_csv(file_path)
 
-        if df.empty:
-            #st.warning(f"Skipping file with no data: {file_path}")
-            return None
-            
-        # Dynamically rename any column containing 'start' to 'start_time' (same for end_time)
-        df.rename(columns={col: 'start_time' for col in df.columns if 'start' in col.lower()}, inplace=True)
-        df.rename(columns={col: 'end_time' for col in df.columns if 'end' in col.lower()}, inplace=True)
-        # Dynamically rename any column containing 'prob' or 'confidence' to 'confidence'
-        df.rename(columns={col: 'confidence' for col in df.columns if any(x in col.lower() for x in ['buzzprob', 'class_prob', 'confidence'])}, inplace=True)
+def _dataframe_size(df):
+    return 1 if df is None else int(df.memory_usage(deep=True).sum())
 
 
-        # Rename columns containing 'scientific' or == 'class' to 'species'
-        df.rename(columns={col: 'species' for col in df.columns if 'scientific' in col.lower() or col.lower() == 'class'}, inplace=True)
-        # Rename columns == 'buzz' to 'event'
-        df.rename(columns={col: 'event' for col in df.columns if col.lower() == 'buzz'}, inplace=True)
+@st.cache_resource
+def get_ingest_cache():
+    """Returns the LRU cache of loaded result files and its lock, shared by all sessions and reruns."""
+    return LRUCache(maxsize=INGEST_CACHE_MAX_BYTES, getsizeof=_dataframe_size), threading.Lock()
 
-        # Handle duplicate columns by adding a prefix to the second occurrence onward
-        cols = pd.Series(df.columns)
-        for idx, col in enumerate(cols):
-            if cols[:idx].eq(col).any():  # If this column name has appeared before
-                cols[idx] = f"{col}_dup"
 
-        df.columns = cols
-        
-        return df
-        
-    except pd.errors.EmptyDataError:
-        st.warning(f"Skipping corrupted file: {file_path}")
-        return None
-    except Exception as e:
-        st.error(f"Error reading file {file_path}: {e}")
-        return None
-        
-def combine_dataframes(manila_path):
+def cached_load_result_file(file_path, model):
+    """Loads a result file through the ingest cache, so only new or changed files are read."""
+    file_stat = os.stat(file_path)
+    key = (file_path, file_stat.st_mtime_ns, file_stat.st_size)
+    cache, lock = get_ingest_cache()
+
+    with lock:
+        if key in cache:
+            return cache[key]
+
+    df = load_result_file(file_path, model)
+
+    with lock:
+        try:
+            cache[key] = df
+        except ValueError:
+            pass  # Larger than the whole cache; not kept
+    return df
+
+
+def combine_dataframes(manila_path, model):
+    """Reads the result CSVs of a model directory into detections in the result store's normalized schema.
+    Used for dates that are not in the result store yet."""
     combined_data = []
 
     for root, _, files in os.walk(manila_path):
-        # Now we ensure the root path has the model folder structure
-        if any(model in root for model in ["frognet", "battybirdnet", "batdetect2", "buzzfindr"]):
-            for file in files:
-                if file.endswith(".csv"):
-                    file_path = os.path.join(root, file)
-                    file_datetime = extract_datetime_from_filename(file)
-
-                    if file_datetime:
-                        df = safe_read_csv(file_path)
-                        if df is None:
-                            continue  # Skip empty/invalid files
-
-                        # Convert start & end times
-                        if 'start_time' in df.columns:
-                            df['start_time'] = df['start_time'].apply(lambda x: file_datetime + timedelta(seconds=x))
-                            # Compute species count per interval
-                            if 'species' in df.columns:
-                                df['species_count'] = df.groupby('start_time')['species'].transform('nunique')
-                            if 'event' in df.columns:
-                                df['event_count'] = df.groupby('start_time')['event'].transform('nunique')
-                                
-                        if 'end_time' in df.columns:
-                            df['end_time'] = df['end_time'].apply(lambda x: file_datetime + timedelta(seconds=x))
-
-                        combined_data.append(df)
-                    
-    if combined_data:
+        for file in files:
+            # Only files declared in result_schemas.py hold detections of the model
+            if get_result_model(file) != model:
+                continue
+            df = cached_load_result_file(os.path.join(root, file), model)
+            if not df.empty:
+                combined_data.append(df)
 
-        # Filter out empty dataframes before concatenation
-        combined_data = [df for df in combined_data if not df.empty]
-    
-        combined_df = pd.concat(combined_data, ignore_index=True)
-
-        # Convert 'start_time' to DatetimeIndex
-        combined_df['start_time'] = pd.to_datetime(combined_df['start_time'])
-        combined_df = combined_df.set_index('start_time')  # Set 'start_time' as the index
-
-        if 'species' in combined_df.columns:
-            # Resample to 10-minute intervals
-            activity_df = combined_df.groupby(['species', pd.Grouper(freq='10min')]).agg({
-                #'species': 'first',  # Ensures each row is unique for each species
-                'species_count': 'count',  # Each row now reflects species count
-                'confidence': 'mean' if 'confidence' in combined_df.columns else None
-            }).reset_index()
-
-            print(activity_df.index)
-            print(activity_df.columns)
-            # Add total_count and unique_species_count for each time frame
-            activity_df['total_activity'] = activity_df.groupby('start_time')['species_count'].transform('sum')
-            activity_df['unique_species_count'] = activity_df.groupby('start_time')['species'].transform('nunique')
-            
-            # Replace remaining invalid or empty 'class' values with NaN
-            if not activity_df.empty and 'species' in activity_df.columns:
-                activity_df['species'] = activity_df['species'].replace({0: None, '0': None, 'No Data': None})
-    
-                # Add a new column for plotting, e.g., filling missing intervals with zero values
-                activity_df['heatmap_value'] = activity_df['species_count'].fillna(0)
-    
-                # Final cleanup for invalid or empty rows
-                activity_df = activity_df.dropna(subset=['species', 'heatmap_value'], how='all')
-
-                if 'KMEANS_CLASSES' in activity_df.columns:
-                    species_to_kmeans_map = combined_df[['species', 'KMEANS_CLASSES']].drop_duplicates().set_index('species')['KMEANS_CLASSES'].to_dict()
-                    # Add 'KMEANS_CLASSES' based on the species map
-                    activity_df['KMEANS_CLASSES'] = activity_df['species'].map(species_to_kmeans_map)
-
-        elif 'event' in combined_df.columns:
-            # Resample to 10-minute intervals
-            activity_df = combined_df.groupby(['event', pd.Grouper(freq='10min')]).agg({
-                #'event': 'first',  # Ensures each row is unique for each species
-                'event_count': 'count',  # Each row now reflects species count
-                'confidence': 'mean' if 'confidence' in combined_df.columns else None
-            }).reset_index()
-            
-            print(activity_df.index)
-            print(activity_df.columns)
-            # Add total_count and unique_species_count for each time frame
-            activity_df['total_activity'] = activity_df.groupby('start_time')['event_count'].transform('sum')
-            activity_df['unique_event_count'] = activity_df.groupby('start_time')['event'].transform('nunique')
-
-            # Replace remaining invalid or empty 'class' values with NaN
-            if not activity_df.empty and 'event' in activity_df.columns:
-                activity_df['event'] = activity_df['event'].replace({0: None, '0': None, 'No Data': None})
-            
-                # Add a new column for plotting, e.g., filling missing intervals with zero values
-                activity_df['heatmap_value'] = activity_df['event_count'].fillna(0)
-        
-                # Final cleanup for invalid or empty rows
-                activity_df = activity_df.dropna(subset=['event', 'heatmap_value'], how='all')
+    if not combined_data:
+        return pd.DataFrame()  # Return empty DataFrame if no data found
 
-        
-        return combined_df, activity_df
-    else:
-        return pd.DataFrame(), pd.DataFrame()  # Return empty DataFrame if no data found
+    return pd.concat(combined_data, ignore_index=True)
 
 
+def load_activity_cubes(date, model, manila_path):
+    """Returns the 1-minute and 10-minute activity cubes of one date and model.
+    The cubes are read from the materialized activity cubes, or computed from the result CSVs
+    for dates whose result files are not all in the result store yet."""
+    result_files = {file for _, _, files in os.walk(manila_path) for file in files
+                    if get_result_model(file) == model and result_store.FILE_DATETIME_PATTERN.search(file).group(1) == date}
+    if result_files and result_files <= result_store.stored_files(date, model):
+        return {resolution: result_store.query_activity(resolution, model=model, periods=[date]) for resolution in ['1min', '10min']}
 
+    detections_df = combine_dataframes(manila_path, model)
+    if detections_df.empty:
+        cube_columns = result_store.CUBE_DIMENSIONS + ['detection_count', 'confidence_sum', 'confidence_count']
+        return {resolution: pd.DataFrame(columns=cube_columns) for resolution in ['1min', '10min']}
+    return {resolution: result_store.compute_activity_cube(detections_df, resolution) for resolution in ['1min', '10min']}
 
-# Create the heatmap
-def combined_activity_chart(activity_df):
 
-    # Check if activity_df is None or empty first
-    if activity_df is None:
-        return None
-    
-    if activity_df.empty:
-        return None
-    # Make a copy to avoid modifying the original dataframe
-    copy_df = activity_df.copy()
+def activity_df_from_cube(cube_df, category):
+    """Converts a 10-minute activity cube to the aggregated activity table used by the heatmap."""
+    if cube_df.empty:
+        return pd.DataFrame()
 
-    print("Columns passed to combined_activity_chart:", copy_df.columns)
-        
-    # Check if we need to reset the index first
-    if 'start_time' not in copy_df.columns and not copy_df.index.name == 'start_time':
-        # If start_time is part of a MultiIndex
-        if isinstance(copy_df.index, pd.MultiIndex) and 'start_time' in copy_df.index.names:
-            copy_df = copy_df.reset_index()
+    activity_df = cube_df.groupby(['label', 'period_start']).agg(
+        detection_count=('detection_count', 'sum'),
+        confidence_sum=('confidence_sum', 'sum'),
+        confidence_count=('confidence_count', 'sum'),
+    ).reset_index()
+    activity_df['confidence'] = activity_df['confidence_sum'] / activity_df['confidence_count'].replace(0, np.nan)
+    activity_df = activity_df.drop(columns=['confidence_sum', 'confidence_count']).rename(columns={
+        'label': category,
+        'period_start': 'start_time',
+        'detection_count': f'{category}_count',
+    })
+
+    # Add total_count and unique_species_count for each time frame
+    activity_df['total_activity'] = activity_df.groupby('start_time')[f'{category}_count'].transform('sum')
+    activity_df[f'unique_{category}_count'] = activity_df.groupby('start_time')[category].transform('nunique')
+
+    # Replace remaining invalid or empty 'class' values with NaN
+    activity_df[category] = activity_df[category].replace({'0': None, 'No Data': None})
+
+    # Add a new column for plotting, e.g., filling missing intervals with zero values
+    activity_df['heatmap_value'] = activity_df[f'{category}_count'].fillna(0)
+
+    # Final cleanup for invalid or empty rows
+    activity_df = activity_df.dropna(subset=[category, 'heatmap_value'], how='all')
+
+    if cube_df['freq_group'].notna().any():
+        species_to_kmeans_map = cube_df.dropna(subset=['freq_group']).drop_duplicates('label').set_index('label')['freq_group'].to_dict()
+        # Add 'KMEANS_CLASSES' based on the species map
+        activity_df['KMEANS_CLASSES'] = activity_df[category].map(species_to_kmeans_map)
+
+    return activity_df
+
+
+
+
+def heatmap_resolution(window_minutes, height=HEATMAP_HEIGHT):
+    """Returns the finest activity cube resolution whose time-of-day bins still fit the figure height."""
+    for resolution, bin_minutes in HEATMAP_RESOLUTIONS.items():
+        if window_minutes / bin_minutes <= height / MIN_CELL_PIXELS:
+            return resolution
+    return list(HEATMAP_RESOLUTIONS)[-1]
+
+
+def time_of_day_bins(resolution, window):
+    """Lists the HH:MM labels of every bin of a resolution inside a (start, end) window of minutes since midnight."""
+    bin_minutes = HEATMAP_RESOLUTIONS[resolution]
+    start, end = window
+    return [f"{minute // 60:02d}:{minute % 60:02d}" for minute in range(start - start % bin_minutes, end, bin_minutes)]
+
+
+def bin_activity_grid(cube_df, column, resolution, window=(0, 24 * 60)):
+    """Aggregates an activity cube to a (time of day x column) grid of detection counts.
+    Only the bins are sent to the browser, so the payload depends on the figure size instead of the number of detections."""
+    if cube_df.empty:
+        return pd.DataFrame()
+
+    period_start = pd.to_datetime(cube_df['period_start'])
+    minutes = period_start.dt.hour * 60 + period_start.dt.minute
+    in_window = (minutes >= window[0]) & (minutes < window[1])
+    # Replace invalid or empty classes
+    in_window &= ~cube_df['label'].isin(['0', 'No Data'])
+
+    grid_df = cube_df[in_window].assign(time_of_day=period_start[in_window].dt.strftime('%H:%M'))
+    if grid_df.empty:
+        return pd.DataFrame()
+
+    heatmap_data = grid_df.pivot_table(
+        index='time_of_day',
+        columns=column,
+        values='detection_count',
+        aggfunc='sum',
+        fill_value=0
+    )
+
+    # Reindex to ensure all times are included, even those without data
+    return heatmap_data.reindex(time_of_day_bins(resolution, window), fill_value=0)
+
+
+def season_activity_grid(model, dates, resolution):
+    """Bins the activity of a model over a range of dates to a (time of day x date) grid.
+    Consecutive dates are merged into one column when there are more dates than fit the figure width."""
+    cube_df = result_store.query_activity(resolution, model=model, periods=dates)
+    if cube_df.empty:
+        return pd.DataFrame()
+
+    days_per_column = int(np.ceil(len(dates) / (HEATMAP_MAX_WIDTH / MIN_CELL_PIXELS)))
+    period_date = pd.to_datetime(cube_df['period_start']).dt.normalize()
+    first_date = pd.to_datetime(dates[0])
+    column_start = first_date + pd.to_timedelta((period_date - first_date).dt.days // days_per_column * days_per_column, unit='D')
+    cube_df = cube_df.assign(date=column_start.dt.strftime('%Y-%m-%d'))
+
+    return bin_activity_grid(cube_df, 'date', resolution)
+
+
+@st.cache_data
+def load_catalog_row_counts(catalog_path, catalog_mtime):
+    """Reads the size and row count of every catalogued result file, keyed by its absolute path."""
+    catalog_df = pd.read_csv(catalog_path, usecols=['path', 'size', 'row_count'], dtype={'path': str})
+    catalog_df = catalog_df.dropna(subset=['row_count'])
+    storage_path = os.path.dirname(catalog_path)
+    return {
+        os.path.join(storage_path, path): (int(size), int(row_count))
+        for path, size, row_count in catalog_df.itertuples(index=False, name=None)
+    }
+
+
+@st.cache_data
+def scan_row_count(file_path, mtime_ns, size):
+    """Counts the rows of a file that is not in the result catalog, keyed on its modification time and size."""
+    return count_rows(file_path)
+
+
+def get_row_count(file_path, storage_path):
+    """Returns the number of rows below the header of a file, from the result catalog when it is up to date."""
+    file_stat = os.stat(file_path)
+    catalog_path = os.path.join(storage_path, RESULT_CATALOG_NAME)
+    if os.path.exists(catalog_path):
+        row_counts = load_catalog_row_counts(catalog_path, os.path.getmtime(catalog_path))
+        size, row_count = row_counts.get(file_path, (None, None))
+        if size == file_stat.st_size:
+            return row_count
+    return scan_row_count(file_path, file_stat.st_mtime_ns, file_stat.st_size)
+
+
+@st.cache_data(max_entries=32)
+def read_file_page(file_path, mtime_ns, page, page_rows):
+    """Reads one page of rows of a data file without loading the rest of it."""
+    skiprows = range(1, page * page_rows + 1)
+    if file_path.endswith(('.xls', '.xlsx')):
+        return pd.read_excel(file_path, skiprows=skiprows, nrows=page_rows)
+    if file_path.endswith('.txt'):
+        with open(file_path, "r", encoding="utf-8", errors="replace") as f:
+            return "".join(islice(f, page * page_rows, (page + 1) * page_rows))
+    try:
+        return pd.read_csv(file_path, skiprows=skiprows, nrows=page_rows)
+    except pd.errors.EmptyDataError:
+        return pd.DataFrame()
+
+
+def preview_file(file_path, storage_path):
+    """Shows a data file one page at a time. The file is only read in full when it is downloaded."""
+    file_name = os.path.basename(file_path)
+    file_stat = os.stat(file_path)
+
+    if st.button("⬇️ Prepare Download", key=f"prepare_{file_path}"):
+        with open(file_path, "rb") as f:
+            st.download_button(label="⬇️ Download File", data=f, file_name=file_name)
+
+    if file_name.endswith(('.xls', '.xlsx')):
+        st.write("### 📊 Excel Preview")
+        num_rows = None
+    else:
+        num_rows = get_row_count(file_path, storage_path)
+        if file_name.endswith(".txt"):
+            st.write("### 📜 Text File Preview")
+            num_rows += 1  # Text files are paged by line, including the first one
         else:
-            raise KeyError("The 'start_time' column is missing from activity_df and not found in index.")
-    
-    # Process data differently based on column presence
-    if 'species' in copy_df.columns:
-        column_category = 'species'
-        category_title = 'Species Class'
-    elif 'event' in copy_df.columns:
-        column_category = 'event'
-        category_title = 'Event'
+            st.write("### 📊 CSV Preview")
+
+    num_pages = max(int(np.ceil(num_rows / PREVIEW_PAGE_ROWS)), 1) if num_rows is not None else None
+    page = st.number_input("Page", min_value=1, max_value=num_pages, value=1, step=1, key=f"page_{file_path}") - 1
+    page_content = read_file_page(file_path, file_stat.st_mtime_ns, page, PREVIEW_PAGE_ROWS)
+
+    first_row = page * PREVIEW_PAGE_ROWS + 1
+    last_row = page * PREVIEW_PAGE_ROWS + (len(page_content.splitlines()) if isinstance(page_content, str) else len(page_content))
+    if num_rows is not None:
+        st.caption(f"Rows {first_row}–{last_row} of {num_rows} (page {page + 1} of {num_pages})")
     else:
-        raise KeyError("Neither 'species' nor 'event' columns exist in the dataframe.")
-    
-    # Ensure data types
-    if 'start_time' in copy_df.columns:
-        copy_df['start_time'] = pd.to_datetime(copy_df['start_time'])
-    copy_df[column_category] = copy_df[column_category].astype(str)
-    
-    # Extract time of day
-    if 'start_time' in copy_df.columns:
-        copy_df['time_of_day'] = copy_df['start_time'].dt.strftime('%H:%M')
+        st.caption(f"Rows {first_row}–{last_row}")
+
+    if isinstance(page_content, str):
+        st.text_area("📄 File Contents", page_content, height=300)
     else:
-        copy_df['time_of_day'] = copy_df.index.strftime('%H:%M')
-    
-    # Ensure we have heatmap_value column
-    if 'heatmap_value' not in copy_df.columns:
-        value_col = f"{column_category}_count"
-        if value_col in copy_df.columns:
-            copy_df['heatmap_value'] = copy_df[value_col].fillna(0)
+        st.dataframe(page_content)
+
+
+def iter_export_files(storage_path, dates, models):
+    """Yields the path of every result file of the given dates and models."""
+    for date in dates:
+        for model in models:
+            model_path = os.path.join(storage_path, date, model)
+            for root, _, files in os.walk(model_path):
+                for file in sorted(files):
+                    yield os.path.join(root, file)
+
+
+def build_export_archive(storage_path, dates, models, labels=None):
+    """Builds a zip archive of the results of a date range.
+    Without labels the result files are copied into the archive chunk by chunk; with labels
+    only the matching detections are read from the result store, one date and model at a time.
+    The archive is only read into memory if it stays within EXPORT_MAX_BYTES; larger exports
+    are stopped as soon as they pass the cap and return None instead of the archive."""
+    num_entries = 0
+
+    with tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_MAX_BYTES) as archive:
+        with zipfile.ZipFile(archive, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+            if not labels:
+                for file_path in iter_export_files(storage_path, dates, models):
+                    arcname = os.path.relpath(file_path, storage_path)
+                    with open(file_path, 'rb') as source, zf.open(arcname, 'w', force_zip64=True) as target:
+                        shutil.copyfileobj(source, target, EXPORT_COPY_CHUNK_BYTES)
+                    num_entries += 1
+                    if archive.tell() > EXPORT_MAX_BYTES:
+                        return None, num_entries
+            else:
+                for date in dates:
+                    for model in models:
+                        detections_df = result_store.query_results(date=date, model=model, labels=labels)
+                        if detections_df.empty:
+                            continue
+                        with zf.open(f"{date}/{model}/{date}_{model}_detections.csv", 'w', force_zip64=True) as target:
+                            detections_df.to_csv(target, index=False)
+                        num_entries += 1
+                        if archive.tell() > EXPORT_MAX_BYTES:
+                            return None, num_entries
+
+        if archive.tell() > EXPORT_MAX_BYTES:
+            return None, num_entries
+
+        # st.download_button takes the archive as bytes, not as a file object
+        archive.seek(0)
+        return archive.read(), num_entries
+
+
+@st.cache_data(ttl=600)
+def load_export_labels(export_dates, export_models):
+    """Lists the species / event labels the result store holds for the selected dates and models."""
+    day_cube_df = result_store.query_activity('1d', periods=list(export_dates))
+    return sorted(day_cube_df.loc[day_cube_df['model'].isin(export_models), 'label'].dropna().unique())
+
+
+def export_section(storage_path, date_directories):
+    """Lets the user download the results of a date range as one zip archive."""
+    st.write("### 📦 Export Results")
+    export_start, export_end = st.select_slider("📅 Select Dates to Export:", options=date_directories,
+                                                value=(date_directories[0], date_directories[-1]), key="export_dates")
+    export_dates = [d for d in date_directories if export_start <= d <= export_end]
+    export_models = st.multiselect("Models:", ["frognet", "battybirdnet", "batdetect2", "buzzfindr"],
+                                   default=["frognet", "battybirdnet", "batdetect2", "buzzfindr"])
+
+    # Species filtering reads the detections from the result store instead of copying the files
+    available_labels = load_export_labels(tuple(export_dates), tuple(export_models))
+    export_labels = st.multiselect("Species / Events (leave empty to export the full result files):", available_labels)
+
+    if st.button("📦 Build Export"):
+        with st.spinner("Building the archive..."):
+            archive, num_entries = build_export_archive(storage_path, export_dates, export_models, export_labels)
+        if num_entries == 0:
+            st.info("No results found for this selection.")
+        elif archive is None:
+            st.error(f"The export is larger than {EXPORT_MAX_BYTES // (1024 * 1024)} MB. "
+                     "Select fewer dates, models or species and build it again.")
         else:
-            raise KeyError(f"Neither 'heatmap_value' nor '{value_col}' columns exist in the dataframe.")
-    
-    # Aggregate duplicate timestamps
-    pivot_data = copy_df.groupby(['time_of_day', column_category]).agg({
-        'heatmap_value': 'sum'
-    }).reset_index()
-    
-    # Create the heatmap data
-    heatmap_data = pivot_data.pivot_table(
-        index='time_of_day',
-        columns=column_category,
-        values='heatmap_value',
-        fill_value=0 
-    )
+            st.download_button(label=f"⬇️ Download {num_entries} Files", data=archive,
+                               file_name=f"ecoacoustic_results_{export_start}_{export_end}.zip", mime="application/zip")
+
+
+# Create the heatmap
+def combined_activity_chart(heatmap_data, category_title, key=None):
 
-    # Generate a complete list of time slots at 10-minute intervals (00:00 to 23:50)
-    all_times = []
-    for hour in range(24):
-        for minute in range(0, 60, 10):
-            all_times.append(f"{hour:02d}:{minute:02d}")
+    # Check if heatmap_data is None or empty first
+    if heatmap_data is None:
+        return None
     
-    # Reindex to ensure all times are included, even those without data
-    heatmap_data = heatmap_data.reindex(all_times, fill_value=0)
-
-    # Create tick values for every 30 minutes
-    tick_values = []
-    tick_text = []
-    for hour in range(24):
-        for minute in range(0, 60, 30):
-            tick_values.append(f"{hour:02d}:{minute:02d}")
-            tick_text.append(f"{hour:02d}:{minute:02d}")
+    if heatmap_data.empty:
+        return None
     
     custom_viridis_spectrum = [
         [0.0, '#2b0136'],    # Darkest Purple
@@ -290,11 +413,12 @@ def combined_activity_chart(activity_df):
         [1.0, '#FDE725']     # Light Yellow
     ]
 
-    # Create the heatmap visualization
+    # Plotly encodes numpy arrays as base64 typed arrays, so the counts are sent as compact uint32 instead of JSON numbers.
+    # Plotly 6 no longer has a WebGL heatmap trace; the bounded grid keeps the SVG heatmap fast instead.
     fig = go.Figure(data=go.Heatmap(
-        z=heatmap_data.values,
-        x=heatmap_data.columns,
-        y=heatmap_data.index,
+        z=heatmap_data.to_numpy(dtype=np.uint32),
+        x=heatmap_data.columns.astype(str).tolist(),
+        y=heatmap_data.index.tolist(),
         xgap=1,
         zmin=0,
         colorscale=custom_viridis_spectrum
@@ -323,40 +447,39 @@ def combined_activity_chart(activity_df):
         yaxis_title='Time of Day (24-hour format)',
         yaxis=dict(autorange='reversed'),  # Flip Y-axis so 00:00 is on top
         coloraxis_colorbar=dict(title="Detections"),
-        height=1200,
+        height=HEATMAP_HEIGHT,
         width=dynamic_width,  # Use much more aggressive dynamic width
         margin=dict(l=50, r=50, b=100, t=100, pad=4)
     )
     
     # Option to use container width only if there are many categories
     use_container = num_categories > 5
-    st.plotly_chart(fig, use_container_width=use_container)
+    st.plotly_chart(fig, use_container_width=use_container, key=key)
 
 
-
-def display_summary_statistics(combined_df):
-    """Prints key statistics about the acoustic detections instead of displaying a table."""
+def display_summary_statistics(minute_cube_df, category):
+    """Prints key statistics about the acoustic detections from the 1-minute activity cube instead of displaying a table."""
     
-    if combined_df.empty:
+    if minute_cube_df.empty:
         #st.warning("⚠ No activity data available to summarize.")
         return
 
      # Print Summary
-    start_date = combined_df.index.date.min()  # Extracts the earliest date in the dataset
+    start_date = pd.to_datetime(minute_cube_df['period_start']).dt.date.min()  # Extracts the earliest date in the dataset
     st.write(f"### 📊 Summary Statistics for {start_date}")
     
-    if 'species' in combined_df.columns:
+    if category == 'species':
     # 1. Count of Unique Species Detected
-        unique_species = combined_df['species'].nunique()
+        unique_species = minute_cube_df['label'].nunique()
         st.write(f"- **Total Unique Species Detected:** {unique_species}")
 
     
     # 2. Percentage of LF vs HF Detections
-    total_detections = len(combined_df)
+    total_detections = minute_cube_df['detection_count'].sum()
 
-    if 'KMEANS_CLASSES' in combined_df.columns:
-        lf_detections = len(combined_df[combined_df['KMEANS_CLASSES'] == 'LF'])
-        hf_detections = len(combined_df[combined_df['KMEANS_CLASSES'] == 'HF'])
+    if minute_cube_df['freq_group'].notna().any():
+        lf_detections = minute_cube_df.loc[minute_cube_df['freq_group'] == 'LF', 'detection_count'].sum()
+        hf_detections = minute_cube_df.loc[minute_cube_df['freq_group'] == 'HF', 'detection_count'].sum()
     
         lf_percentage = (lf_detections / total_detections) * 100 if total_detections > 0 else 0
         hf_percentage = (hf_detections / total_detections) * 100 if total_detections > 0 else 0
@@ -365,7 +488,7 @@ def display_summary_statistics(combined_df):
         st.write(f"- **High-Frequency Detections:** {hf_percentage:.2f}%")
         
     # 3. Percentage of the Day with a Detection
-    detected_times = combined_df.index.floor('min').nunique()  # Unique time slots with detections
+    detected_times = minute_cube_df['period_start'].nunique()  # Unique time slots with detections
     total_time_slots = 24 * 60  # Total minutes in a day
 
     day_coverage = (detected_times / total_time_slots) * 100 if total_time_slots > 0 else 0
@@ -584,35 +707,21 @@ elif page == "dashboard":
                     dir_contents = os.listdir(model_path)
 
                     data_files = [f for f in dir_contents if f.endswith(('.csv', '.xls', '.xlsx', '.txt'))]
-                    combined_df, activity_df = combine_dataframes(model_path)
+                    # Read the materialized activity cubes; dates that are not in the result store are computed from their CSVs
+                    activity_cubes = load_activity_cubes(selected_directory, selected_model, model_path)
+                    category = 'event' if selected_model == 'buzzfindr' else 'species'
+                    activity_df = activity_df_from_cube(activity_cubes['10min'], category)
 
                     if data_files:
                         selected_file = st.selectbox("📑 Select a Data File:", sorted(data_files))
                         file_path = os.path.join(model_path, selected_file)
 
-                        with open(file_path, "rb") as f:
-                            st.download_button(label="⬇️ Download File", data=f, file_name=selected_file)
-
-                        if selected_file.endswith(".csv"):
-                            df = safe_read_csv(file_path)
-                            st.write("### 📊 CSV Preview")
-                            st.dataframe(df)
-
-                        elif selected_file.endswith(('.xls', '.xlsx')):
-                            df = pd.read_excel(file_path)
-                            st.write("### 📊 Excel Preview")
-                            st.dataframe(df)
-
-                        elif selected_file.endswith(".txt"):
-                            st.write("### 📜 Text File Preview")
-                            with open(file_path, "r", encoding="utf-8") as f:
-                                text_content = f.read()
-                                st.text_area("📄 File Contents", text_content, height=300)
+                        preview_file(file_path, MANILA_STORAGE_PATH)
 
                     
                     # Display summary statistics only if data exists
-                    if not combined_df.empty:
-                        display_summary_statistics(combined_df)
+                    if not activity_cubes['1min'].empty:
+                        display_summary_statistics(activity_cubes['1min'], category)
 
                     # Display tables and charts only if they exist
                     if not activity_df.empty:
@@ -622,12 +731,33 @@ elif page == "dashboard":
                         
                         st.markdown("---")  # Horizontal line
                         st.write("### EcoAcoustic Activity Heatmap")
-                        combined_activity_chart(activity_df)
+                        # Zooming in re-bins the heatmap from a finer activity cube
+                        zoom_start, zoom_end = st.slider("🔍 Zoom to Time of Day:", value=(time(0, 0), time(23, 50)),
+                                                         step=timedelta(minutes=10), format="HH:mm")
+                        window = (zoom_start.hour * 60 + zoom_start.minute, zoom_end.hour * 60 + zoom_end.minute + 10)
+                        resolution = heatmap_resolution(window[1] - window[0])
+                        heatmap_data = bin_activity_grid(activity_cubes[resolution], 'label', resolution, window)
+                        combined_activity_chart(heatmap_data, 'Event' if category == 'event' else 'Species Class')
+
+                        st.markdown("---")  # Horizontal line
+                        st.write("### Seasonal Activity Heatmap")
+                        season_start, season_end = st.select_slider("📅 Select a Date Range:", options=sorted(directories_8digit),
+                                                                    value=(sorted(directories_8digit)[0], selected_directory))
+                        season_dates = [d for d in sorted(directories_8digit) if season_start <= d <= season_end]
+                        season_data = season_activity_grid(selected_model, season_dates, heatmap_resolution(24 * 60))
+                        if season_data.empty:
+                            st.info("No activity in the result store for this date range.")
+                        else:
+                            combined_activity_chart(season_data, 'Date', key="season_heatmap")
                     else:
                         st.info("No aggregated activity data available.")
                 else:
                     st.info("📂 No data files found in this directory.")
 
+        if directories_8digit:
+            st.markdown("---")  # Horizontal line
+            export_section(MANILA_STORAGE_PATH, sorted(directories_8digit))
+
         # Check if the current directory is a bat model folder
         is_bat_folder = any(bat_keyword in selected_model.lower() 
                             for bat_keyword in ['bat', 'buzz'])
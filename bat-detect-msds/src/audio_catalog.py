@@ -0,0 +1,245 @@
+import sqlite3
+from pathlib import Path
+
+import pandas as pd
+
+# Persistent SQLite catalog of the collected audio records written by file_dealer.py.
+# Rows are indexed by site/year/month and by deployment session so pipeline runs only
+# load the files they ask for instead of the whole multi-year inventory.
+
+DEFAULT_CATALOG_PATH = Path(__file__).parent / "../output_dir/ubna_audio_catalog.db"
+
+INVENTORY_COLUMNS = [
+    "datetime_UTC",
+    "site_name",
+    "recover_folder",
+    "audiomoth_num",
+    "sd_card_num",
+    "file_path",
+    "file_metadata",
+    "file_status",
+    "audiomoth_temperature",
+    "audiomoth_battery",
+    "sample_rate",
+    "audiomoth_artist_ID",
+    "file_duration",
+    "Deployment notes",
+]
+
+ERROR_DURATIONS = [
+    "File has no comment due to error!",
+    "File has no Audiomoth-related comment",
+    "Is empty!",
+]
+
+CSV_CHUNKSIZE = 100000
+
+
+def _quote(column):
+    return '"' + column.replace('"', '""') + '"'
+
+
+def connect_catalog(catalog_path=DEFAULT_CATALOG_PATH):
+    """
+    Opens the audio catalog, creating its tables and indexes if they do not exist yet.
+
+    Parameters
+    ------------
+    catalog_path : `str` or `pathlib.Path`
+        - The path to the SQLite file of the catalog
+
+    Returns
+    ------------
+    conn : `sqlite3.Connection`
+        - The open connection to the catalog
+    """
+
+    Path(catalog_path).parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(catalog_path)
+    inventory_columns = ",\n".join(f"{_quote(column)} TEXT" for column in INVENTORY_COLUMNS if column != "file_path")
+    conn.executescript(f"""
+        CREATE TABLE IF NOT EXISTS audio_files (
+            file_path TEXT PRIMARY KEY,
+            {inventory_columns},
+            year INTEGER,
+            month INTEGER,
+            source TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_audio_files_location ON audio_files (site_name, year, month);
+        CREATE INDEX IF NOT EXISTS idx_audio_files_session ON audio_files (recover_folder, sd_card_num);
+        CREATE TABLE IF NOT EXISTS sources (
+            source TEXT PRIMARY KEY,
+            size INTEGER,
+            mtime REAL
+        );
+    """)
+    return conn
+
+
+def get_catalogued_paths(conn):
+    """
+    Returns the set of file paths that are already in the catalog.
+    """
+
+    return {row[0] for row in conn.execute("SELECT file_path FROM audio_files")}
+
+
+def count_source_rows(conn, source):
+    """
+    Returns the number of catalogued rows that came from a records .csv file.
+    """
+
+    return conn.execute("SELECT COUNT(*) FROM audio_files WHERE source = ?", (source,)).fetchone()[0]
+
+
+def append_files_df(conn, files_df, source):
+    """
+    Adds the rows of an inventory DataFrame to the catalog, replacing rows of the same file path.
+
+    Parameters
+    ------------
+    conn : `sqlite3.Connection`
+        - The open connection to the catalog
+    files_df : `pandas.DataFrame`
+        - Rows in the format of the ubna_data_*_collected_audio_records.csv files
+    source : `str`
+        - The name of the records .csv file the rows belong to
+    """
+
+    if files_df.empty:
+        return
+
+    rows_df = files_df.reindex(columns=INVENTORY_COLUMNS)
+    datetimes = pd.to_datetime(rows_df["datetime_UTC"], errors="coerce")
+    records = []
+    for row, timestamp in zip(rows_df.itertuples(index=False, name=None), datetimes):
+        values = [None if pd.isna(value) else str(value) for value in row]
+        if pd.isna(timestamp):
+            values[0] = None
+            records += [values + [None, None, source]]
+        else:
+            values[0] = timestamp.strftime("%Y-%m-%d %H:%M:%S")
+            records += [values + [timestamp.year, timestamp.month, source]]
+
+    columns = INVENTORY_COLUMNS + ["year", "month", "source"]
+    placeholders = ", ".join("?" for _ in columns)
+    with conn:
+        conn.executemany(
+            f"INSERT OR REPLACE INTO audio_files ({', '.join(_quote(column) for column in columns)}) VALUES ({placeholders})",
+            records,
+        )
+
+
+def record_source(conn, csv_path):
+    """
+    Stores the size and modification time of a records .csv file whose rows are in the catalog.
+    """
+
+    csv_stat = Path(csv_path).stat()
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO sources (source, size, mtime) VALUES (?, ?, ?)",
+            (Path(csv_path).name, csv_stat.st_size, csv_stat.st_mtime),
+        )
+
+
+def sync_records_csvs(conn, csv_paths):
+    """
+    Imports the records .csv files that changed since they were last imported into the catalog.
+
+    Parameters
+    ------------
+    conn : `sqlite3.Connection`
+        - The open connection to the catalog
+    csv_paths : `list` of `pathlib.Path`
+        - The ubna_data_*_collected_audio_records.csv files to keep in sync
+    """
+
+    known_sources = {source : (size, mtime) for source, size, mtime in conn.execute("SELECT source, size, mtime FROM sources")}
+    for csv_path in csv_paths:
+        csv_stat = Path(csv_path).stat()
+        if known_sources.get(Path(csv_path).name) == (csv_stat.st_size, csv_stat.st_mtime):
+            continue
+
+        print(f"Importing {csv_path} into the audio catalog")
+        for records_chunk in pd.read_csv(csv_path, dtype=str, chunksize=CSV_CHUNKSIZE):
+            append_files_df(conn, records_chunk, Path(csv_path).name)
+        record_source(conn, csv_path)
+
+
+def _read_query(conn, where_clauses, params):
+    query = f"SELECT {', '.join(_quote(column) for column in INVENTORY_COLUMNS)} FROM audio_files"
+    if where_clauses:
+        query += " WHERE " + " AND ".join(where_clauses)
+    files_df = pd.read_sql_query(query, conn, params=params)
+    files_df["datetime_UTC"] = pd.DatetimeIndex(files_df["datetime_UTC"])
+    files_df.set_index("datetime_UTC", inplace=True)
+
+    return files_df.sort_index()
+
+
+def query_location(conn, site, year, month, cycle_minutes=(0, 30)):
+    """
+    Selects the usable-looking files recorded at a site in a month.
+
+    Parameters
+    ------------
+    conn : `sqlite3.Connection`
+        - The open connection to the catalog
+    site : `str`
+        - The site name as it appears in the field records
+    year : `int`
+        - The year the files were recorded in
+    month : `int`
+        - The month the files were recorded in
+    cycle_minutes : `tuple` of `int`
+        - The minutes of the hour at which the recording cycles start
+
+    Returns
+    ------------
+    files_df : `pandas.DataFrame`
+        - The matching rows indexed by datetime_UTC, with files that start off-cycle
+        or have an error in place of a duration left out (files with an unknown duration are kept)
+    """
+
+    where_clauses = [
+        "site_name = ?",
+        "year = ?",
+        "month = ?",
+        f"CAST(strftime('%M', datetime_UTC) AS INTEGER) IN ({', '.join('?' for _ in cycle_minutes)})",
+        "CAST(strftime('%S', datetime_UTC) AS INTEGER) = 0",
+        f"(file_duration IS NULL OR file_duration NOT IN ({', '.join('?' for _ in ERROR_DURATIONS)}))",
+    ]
+    params = [site, year, month] + list(cycle_minutes) + ERROR_DURATIONS
+
+    return _read_query(conn, where_clauses, params)
+
+
+def query_deployment_session(conn, recover_folder, sd_card_num, source=None):
+    """
+    Selects the files of a deployment session.
+
+    Parameters
+    ------------
+    conn : `sqlite3.Connection`
+        - The open connection to the catalog
+    recover_folder : `str`
+        - The recover-DATE folder of the session
+    sd_card_num : `str`
+        - The SD card # of the session
+    source : `str`
+        - If given, only rows imported from this records .csv file are selected
+
+    Returns
+    ------------
+    files_df : `pandas.DataFrame`
+        - The matching rows indexed by datetime_UTC
+    """
+
+    where_clauses = ["recover_folder = ?", "sd_card_num = ?"]
+    params = [recover_folder, sd_card_num]
+    if source is not None:
+        where_clauses += ["source = ?"]
+        params += [source]
+
+    return _read_query(conn, where_clauses, params)
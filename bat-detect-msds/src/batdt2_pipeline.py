@@ -1,19 +1,21 @@
 import numpy as np
 import argparse
 import pandas as pd
-import dask.dataframe as dd
 import soundfile as sf
 from tqdm import tqdm
 
+import matplotlib
+matplotlib.use('Agg')  # Figures are only saved to files; no display in the containers
 import matplotlib.pyplot as plt
 import matplotlib.colors as colors
 
+import json
+import hashlib
 import datetime as dt
 from pathlib import Path
 from torch import multiprocessing
 
 import exiftool
-import suncalc
 from sklearn.cluster import KMeans
 import scipy
 
@@ -25,9 +27,10 @@ sys.path.append(str(Path.cwd() / "src/models/bat_call_detector/batdetect2/"))
 from cfg import get_config
 from pipeline import pipeline
 from utils.utils import gen_empty_df, convert_df_ravenpro
-
-SEATTLE_LATITUDE = 47.655181
-SEATTLE_LONGITUDE = -122.293123
+import audio_catalog
+import cumulative_store
+import solar_tables
+import energy_gate
 
 
 FREQ_GROUPS = {
@@ -62,7 +65,9 @@ LABEL_FOR_GROUPS = {
                     1: 'HF'
                     }
 
-def generate_segments(audio_file: Path, output_dir: Path, start_time: float, duration: float):
+def generate_segments(audio_file: Path, output_dir: Path, start_time: float, duration: float, night_site=None, night_margin=pd.Timedelta(0),
+                      gate_bands=None, gate_threshold_db=energy_gate.DEFAULT_THRESHOLD_DB,
+                      gate_min_calls=energy_gate.DEFAULT_MIN_CALLS):
     """
     Segments audio file into clips of duration length and saves them to output/tmp folder.
     Allows detection model to be run on segments instead of entire file as recommended.
@@ -78,6 +83,16 @@ def generate_segments(audio_file: Path, output_dir: Path, start_time: float, dur
         - The time at which the segments will start being generated from within the audio file
     duration : `float`
         - The duration of all segments generated from the audio file.
+    night_site : `str`
+        - If given, only segments that overlap the civil night at this site (see solar_tables.py) are generated.
+    night_margin : `pd.Timedelta`
+        - How far the night is extended before dusk and after dawn.
+    gate_bands : `List`
+        - If given, segments without a train of calls above the noise floor in any of these [low, high] bands are skipped (see energy_gate.py).
+    gate_threshold_db : `float`
+        - How far (dB) above the noise floor a frame has to rise to count as active.
+    gate_min_calls : `int`
+        - How many calls (runs of active frames) a band needs for the segment to be kept.
 
     Returns
     ------------
@@ -97,8 +112,15 @@ def generate_segments(audio_file: Path, output_dir: Path, start_time: float, dur
 
     output_files = []
 
+    sub_starts = np.arange(ip_start, ip_end, ip_duration)
+    if night_site is not None:
+        file_start = solar_tables.get_file_start_times([audio_file])[0]
+        segment_starts = file_start + pd.to_timedelta(sub_starts / sampling_rate, unit='s')
+        sub_starts = sub_starts[solar_tables.get_recording_night_mask(night_site, segment_starts, pd.Timedelta(seconds=duration), night_margin)]
+    num_gated = 0
+
     # for the length of the duration, process the audio into duration length clips
-    for sub_start in range(ip_start, ip_end, ip_duration):
+    for sub_start in sub_starts.tolist():
         sub_end = np.minimum(sub_start + ip_duration, ip_end)
 
         # For file names, convert back to seconds 
@@ -109,20 +131,79 @@ def generate_segments(audio_file: Path, output_dir: Path, start_time: float, dur
         op_file = op_file[:-4] + op_file_en + ".wav"
         
         op_path = output_dir / op_file
+
+        # The energy gate measures the samples that are read for the segment anyway
+        if (not(op_path.exists())):
+            sub_length = sub_end - sub_start
+            ip_audio.seek(sub_start)
+            op_audio = ip_audio.read(sub_length, dtype='float32')
+            if gate_bands is not None and not energy_gate.gate_segment(energy_gate.compute_band_energies(op_audio, sampling_rate, gate_bands),
+                                                                         gate_threshold_db, gate_min_calls):
+                num_gated += 1
+                continue
+            sf.write(op_path, op_audio, sampling_rate, subtype='PCM_16')
+
         output_files.append({
             "input_filepath": audio_file,
             "audio_file": op_path, 
             "offset":  start_time + (sub_start/sampling_rate),
         })
-        
-        if (not(op_path.exists())):
-            sub_length = sub_end - sub_start
-            ip_audio.seek(sub_start)
-            op_audio = ip_audio.read(sub_length)
-            sf.write(op_path, op_audio, sampling_rate, subtype='PCM_16')
+
+    if gate_bands is not None:
+        print(f"Energy gate skipped {num_gated} of {len(sub_starts)} segments of {audio_file.name}")
 
     return output_files 
 
+def get_night_site(cfg):
+    """
+    Returns the site whose civil night restricts processing, or None if all hours are processed.
+    """
+
+    if not cfg.get('night_only', False):
+        return None
+    return cfg.get('night_site', cfg['site'])
+
+
+def get_energy_gate_bands(cfg):
+    """
+    Returns the [low, high] frequency bands the energy gate measures, or None if the gate is off.
+    The bands are the LF and HF groups of the site in FREQ_GROUPS; unknown sites use those of Carp Pond.
+    """
+
+    if not cfg.get('energy_gate', False):
+        return None
+    site_groups = FREQ_GROUPS.get(cfg.get('night_site', cfg.get('site')), FREQ_GROUPS['Carp Pond'])
+    return [band for group, band in site_groups.items() if group != '']
+
+
+def gen_empty_detections_df():
+    """
+    Generates the empty detections DataFrame of files whose segments were all skipped, with the columns run_models() gives.
+    """
+
+    empty_df = gen_empty_df()
+    empty_df.insert(0, 'SNR', [])
+    empty_df.insert(0, 'peak_frequency', [])
+    empty_df.insert(0, 'KMEANS_CLASSES', [])
+    empty_df['sampling_rate'] = []
+    empty_df['input_file'] = []
+    return empty_df
+
+
+def filter_df_to_night(files_df, site, cfg):
+    """
+    Keeps the files of a datetime_UTC-indexed DataFrame that overlap the civil night at a site when night_only is set.
+    """
+
+    if not cfg.get('night_only', False) or files_df.empty:
+        return files_df
+
+    is_night = solar_tables.get_recording_night_mask(site, files_df.index, pd.Timedelta(seconds=cfg['duration']),
+                                                     pd.Timedelta(minutes=cfg.get('night_margin', 30)))
+    print(f"Skipping {(~is_night).sum()} daytime files at {site}")
+    return files_df.loc[is_night]
+
+
 def generate_segmented_paths(audio_files, cfg):
     """
     Generates and returns a list of segments using provided cfg parameters for each audio file in audio_files.
@@ -151,6 +232,11 @@ def generate_segmented_paths(audio_files, cfg):
             output_dir = cfg['tmp_dir'],
             start_time = cfg['start_time'],
             duration   = cfg['segment_duration'],
+            night_site = get_night_site(cfg),
+            night_margin = pd.Timedelta(minutes=cfg.get('night_margin', 30)),
+            gate_bands = get_energy_gate_bands(cfg),
+            gate_threshold_db = cfg.get('energy_gate_db', energy_gate.DEFAULT_THRESHOLD_DB),
+            gate_min_calls = cfg.get('energy_gate_calls', energy_gate.DEFAULT_MIN_CALLS),
         )
     return segmented_file_paths
 
@@ -320,6 +406,9 @@ def run_models(file_mappings):
         - Events are always "Echolocation" as we are using a model that only detects search-phase calls.
     """
 
+    if not file_mappings:
+        return gen_empty_detections_df()
+
     bd_dets = pd.DataFrame()
     for i in tqdm(range(len(file_mappings))):
         cur_seg = file_mappings[i]
@@ -366,6 +455,9 @@ def apply_models(file_path_mappings, cfg):
         - Events are always "Echolocation" as we are using a model that only detects search-phase calls.
     """
 
+    if not file_path_mappings:
+        return gen_empty_detections_df()
+
     process_pool = multiprocessing.Pool(cfg['num_processes'])
 
     bd_dets = tqdm(
@@ -522,12 +614,13 @@ def construct_activity_arr(cfg, data_params):
     return activity_dets_arr
 
 
-def shape_activity_array_into_grid(cfg, data_params, group):
+def shape_activity_array_into_grid(cfg, data_params, group, num_dets=None):
 
     csv_tag = cfg['csv_filename'].split('__')[-1]
 
-    num_dets = pd.read_csv(f"{data_params['output_dir']}/activity__{csv_tag}.csv", index_col=0)
-    num_dets.index = pd.DatetimeIndex(num_dets.index)
+    if num_dets is None:
+        num_dets = pd.read_csv(f"{data_params['output_dir']}/activity__{csv_tag}.csv", index_col=0)
+        num_dets.index = pd.DatetimeIndex(num_dets.index)
 
     resampled_df = num_dets.resample(data_params["resample_tag"]).sum().between_time(cfg['recording_start'], cfg['recording_end'], inclusive='left')
 
@@ -592,14 +685,24 @@ def plot_activity_grid(plot_df, data_params, group, show_PST=False, save=True):
     plt.xlabel('Date (MM/DD/YY)')
     plt.colorbar()
     if save:
-        plt.savefig(f"{data_params['output_dir']}/activity_plot__{group}{data_params['recover_folder']}_{data_params['audiomoth_folder']}.png", bbox_inches='tight', pad_inches=0.5)
+        plt.savefig(get_activity_grid_plot_path(data_params, group), bbox_inches='tight', pad_inches=0.5)
     plt.tight_layout()
-    plt.show()
+    plt.close()
+
+
+def get_activity_grid_plot_path(data_params, group):
+    return Path(f"{data_params['output_dir']}/activity_plot__{group}{data_params['recover_folder']}_{data_params['audiomoth_folder']}.png")
+
+
+def get_cumulative_plot_path(data_params, group):
+    cum_plots_dir = f'{Path(__file__).parent}/../output_dir/cumulative_plots/2023'
+    return Path(f'{cum_plots_dir}/cumulative_activity__2023_{group}{data_params["site"].split()[0]}_{data_params["resample_tag"]}.png')
 
 def construct_cumulative_activity(data_params, cfg, group, save=True):
     """
-    Constructs a cumulative appended DataFrame grid using dask.dataframe.
-    This DataFrame gathers all detected activity contained in output_dir for a given site.
+    Constructs a cumulative DataFrame grid of all detected activity contained in output_dir for a given site.
+    New or changed activity__*.csv files are added to the site's cumulative store and only the dates
+    they cover are resampled and pivoted into the stored grid.
 
     Parameters
     ------------
@@ -620,27 +723,11 @@ def construct_cumulative_activity(data_params, cfg, group, save=True):
             - Recordings where the Audiomoth experienced errors are colored red.
     """
 
-    new_df = dd.read_csv(f"{Path(__file__).parent}/../output_dir/{data_params['selection_of_dates']}/{data_params['site']}/activity__*.csv", assume_missing=True).compute()
-    new_df["date_and_time_UTC"] = pd.to_datetime(new_df["date_and_time_UTC"], format="%Y-%m-%d %H:%M:%S%z")
-
-    resampled_df = new_df.resample(data_params["resample_tag"], on="date_and_time_UTC").sum().between_time(cfg['recording_start'], cfg['recording_end'], inclusive='left')
-
-    activity_datetimes = pd.to_datetime(resampled_df.index.values)
-    raw_dates = activity_datetimes.date
-    raw_times = activity_datetimes.strftime("%H:%M")
-    mask = resampled_df.columns.str.contains(f'{group}.*')
-    if group!='':
-        mask = resampled_df.columns.str.contains(f'{group}.*')
-        selected_group = resampled_df.loc[:,mask]
-        if selected_group.shape[1]>2:
-            middle_col = selected_group.iloc[:,1]
-            middle_col.loc[middle_col<=1.0] = 0
-        data = list(zip(raw_dates, raw_times, selected_group.sum(axis=1)))
-    else:
-        data = list(zip(raw_dates, raw_times, resampled_df[f'{group}num_of_detections']))
-    activity = pd.DataFrame(data, columns=["Date (UTC)", "Time (UTC)", f'{group}num_of_detections'])
-    activity_df = activity.pivot(index="Time (UTC)", columns="Date (UTC)", values=f'{group}num_of_detections')
-    activity_df.columns = pd.to_datetime(activity_df.columns).strftime('%m/%d/%y')
+    activity_csvs = sorted(Path(f"{Path(__file__).parent}/../output_dir").glob(f"{data_params['selection_of_dates']}/{data_params['site']}/activity__*.csv"))
+    site_dir = cumulative_store.get_site_store(cfg.get('cumulative_store_dir', cumulative_store.DEFAULT_STORE_DIR), data_params['site'])
+    cumulative_store.sync_activity_csvs(site_dir, activity_csvs)
+    activity_df = cumulative_store.update_cumulative_grid(site_dir, data_params['selection_of_dates'], group, data_params["resample_tag"],
+                                                          cfg['recording_start'], cfg['recording_end'])
     cum_plots_dir = f'{Path(__file__).parent}/../output_dir/cumulative_plots/'
     if save:
         activity_df.to_csv(f'{cum_plots_dir}/cumulative_activity__{group}{data_params["site"].split()[0]}_{data_params["resample_tag"]}.csv')
@@ -688,10 +775,9 @@ def plot_cumulative_activity(activity_df, data_params, group, save=True):
     plot_times[::3] = activity_times[::3]
 
     activity_dates = pd.to_datetime(activity_df.columns.values, format='%m/%d/%y')
-    activity_lat = [SEATTLE_LATITUDE]*len(activity_dates)
-    activity_lon = [SEATTLE_LONGITUDE]*len(activity_dates)
-    sunrise_time = pd.DatetimeIndex(suncalc.get_times(activity_dates, activity_lon, activity_lat)['sunrise_end'])
-    sunset_time = pd.DatetimeIndex(suncalc.get_times(activity_dates, activity_lon, activity_lat)['sunset_start'])
+    solar_events = solar_tables.get_solar_events(data_params['site'], activity_dates)
+    sunrise_time = pd.DatetimeIndex(solar_events['sunrise_end'])
+    sunset_time = pd.DatetimeIndex(solar_events['sunset_start'])
     sunrise_seconds_from_midnight = sunrise_time.hour * 3600 + sunrise_time.minute*60 + sunrise_time.second
     sunset_seconds_from_midnight = sunset_time.hour * 3600 + sunset_time.minute*60 + sunset_time.second
 
@@ -715,13 +801,73 @@ def plot_cumulative_activity(activity_df, data_params, group, save=True):
     plt.legend(loc=3, fontsize=(2*len(plot_dates)**0.5))
     plt.grid(which='both')
     plt.tight_layout()
-    cum_plots_dir = f'{Path(__file__).parent}/../output_dir/cumulative_plots/2023'
     if save:
-        plt.savefig(f'{cum_plots_dir}/cumulative_activity__2023_{group}{data_params["site"].split()[0]}_{data_params["resample_tag"]}.png', 
-                    bbox_inches='tight')
-        file = f'{cum_plots_dir}/cumulative_activity__{group}{data_params["site"].split()[0]}_{data_params["resample_tag"]}.png'
+        file = get_cumulative_plot_path(data_params, group)
+        plt.savefig(file, bbox_inches='tight')
         print(file)
-    #plt.show()
+    plt.close()
+
+
+FIGURE_PLOTTERS = {
+    'activity_grid': (plot_activity_grid, get_activity_grid_plot_path),
+    'cumulative': (plot_cumulative_activity, get_cumulative_plot_path),
+}
+
+
+def _figure_input_hash(figure_job):
+    input_hash = hashlib.sha1()
+    input_hash.update(pd.util.hash_pandas_object(figure_job['plot_df'], index=True).values.tobytes())
+    input_hash.update(json.dumps([figure_job['kind'], figure_job['group'], list(figure_job['plot_df'].columns)], default=str).encode())
+    input_hash.update(json.dumps(figure_job['data_params'], sort_keys=True, default=str).encode())
+    return input_hash.hexdigest()
+
+
+def render_figure(figure_job):
+    """
+    Renders one figure unless the figure already saved was rendered from the same inputs.
+
+    Parameters
+    ------------
+    figure_job : `dict`
+        - kind : a key of FIGURE_PLOTTERS
+        - plot_df : the activity grid to plot
+        - data_params : the data parameters the plot function uses (site, folders, resample_tag, show_PST)
+        - group : the frequency group: '', 'LF' or 'HF'
+
+    Returns
+    ------------
+    figure_path : `pathlib.Path`
+        - The path of the rendered figure, or None if it was up to date
+    """
+
+    plot_function, get_figure_path = FIGURE_PLOTTERS[figure_job['kind']]
+    figure_path = get_figure_path(figure_job['data_params'], figure_job['group'])
+    hash_path = figure_path.with_suffix('.png.sha1')
+    input_hash = _figure_input_hash(figure_job)
+    if figure_path.is_file() and hash_path.is_file() and hash_path.read_text() == input_hash:
+        return None
+
+    figure_path.parent.mkdir(parents=True, exist_ok=True)
+    plot_function(figure_job['plot_df'], figure_job['data_params'], figure_job['group'], save=True)
+    hash_path.write_text(input_hash)
+
+    return figure_path
+
+
+def render_figures(figure_jobs, cfg):
+    """
+    Renders a list of figure jobs (see render_figure()) in a pool of processes.
+    """
+
+    num_processes = max(1, min(cfg['num_processes'], len(figure_jobs)))
+    if num_processes == 1:
+        figure_paths = [render_figure(figure_job) for figure_job in figure_jobs]
+    else:
+        with multiprocessing.Pool(num_processes) as process_pool:
+            figure_paths = process_pool.map(render_figure, figure_jobs, chunksize=1)
+
+    num_skipped = sum(figure_path is None for figure_path in figure_paths)
+    print(f"Rendered {len(figure_jobs) - num_skipped} figures, {num_skipped} unchanged figures skipped")
 
 def delete_segments(necessary_paths):
     """
@@ -745,6 +891,13 @@ def run_pipeline_on_file(file, cfg):
     if not cfg['tmp_dir'].is_dir():
         cfg['tmp_dir'].mkdir(parents=True, exist_ok=True)
 
+    night_site = get_night_site(cfg)
+    if night_site is not None:
+        file_df = pd.DataFrame(index=solar_tables.get_file_start_times([file]))
+        if filter_df_to_night(file_df, night_site, cfg).empty:
+            print(f"Skipping {file.name}, recorded during the day")
+            return bd_preds
+
     if (cfg['run_model']):
         cfg["csv_filename"] = f"batdetect2_pipeline_{file.name.split('.')[0]}"
         print(f"Generating detections for {file.name}")
@@ -803,13 +956,9 @@ def get_params_relevant_to_data_at_location(cfg):
     data_params['site'] = cfg['site']
     print(f"Searching for files from {cfg['site']} in {cfg['month']} {cfg['year']}")
 
-    hard_drive_df = dd.read_csv(f'{Path(__file__).parent}/../output_dir/ubna_data_*_collected_audio_records.csv', dtype=str).compute()
-    if 'Unnamed: 0' in hard_drive_df.columns:
-        hard_drive_df.drop(columns='Unnamed: 0', inplace=True)
-    hard_drive_df["datetime_UTC"] = pd.DatetimeIndex(hard_drive_df["datetime_UTC"])
-    hard_drive_df.set_index("datetime_UTC", inplace=True)
-    
-    files_from_location = filter_df_with_location(hard_drive_df, cfg)
+    catalog = open_audio_catalog(cfg)
+    files_from_location = filter_df_with_location(catalog, cfg)
+    catalog.close()
     data_params['output_dir'] = cfg["output_dir"] / data_params["site"]
     print(f"Will save csv file to {data_params['output_dir']}")
 
@@ -829,18 +978,33 @@ def get_params_relevant_to_data_at_location(cfg):
     return good_location_df, data_params
 
 
-def filter_df_with_location(ubna_data_df, cfg):
-    site_name_cond = ubna_data_df["site_name"] == cfg['site']
-    file_year_cond = ubna_data_df.index.year == (dt.datetime.strptime(cfg['year'], '%Y')).year
-    file_month_cond = ubna_data_df.index.month == (dt.datetime.strptime(cfg['month'], '%B')).month
-    minute_cond = np.logical_or((ubna_data_df.index).minute == 30, (ubna_data_df.index).minute == 0)
-    datetime_cond = np.logical_and((ubna_data_df.index).second == 0, minute_cond)
-    file_error_cond = np.logical_and((ubna_data_df["file_duration"]!='File has no comment due to error!'), (ubna_data_df["file_duration"]!='File has no Audiomoth-related comment'))
-    all_errors_cond = np.logical_and((ubna_data_df["file_duration"]!='Is empty!'), file_error_cond)
-    file_date_cond = np.logical_and(file_year_cond, file_month_cond)
+def open_audio_catalog(cfg):
+    """Opens the audio catalog after importing any collected audio records that changed since the last run.
+
+    Parameters
+    ------------
+    cfg : `dict`
+        - The pipeline configuration; `catalog_path` overrides the default catalog location
 
-    filtered_location_df = ubna_data_df.loc[site_name_cond&datetime_cond&file_date_cond&all_errors_cond].sort_index()
+    Returns
+    ------------
+    catalog : `sqlite3.Connection`
+        - The open connection to the catalog
+    """
+
+    catalog = audio_catalog.connect_catalog(cfg.get('catalog_path', audio_catalog.DEFAULT_CATALOG_PATH))
+    records_csvs = sorted(Path(f'{Path(__file__).parent}/../output_dir').glob('ubna_data_*_collected_audio_records.csv'))
+    audio_catalog.sync_records_csvs(catalog, records_csvs)
+
+    return catalog
+
+
+def filter_df_with_location(catalog, cfg):
+    file_year = (dt.datetime.strptime(cfg['year'], '%Y')).year
+    file_month = (dt.datetime.strptime(cfg['month'], '%B')).month
+    filtered_location_df = audio_catalog.query_location(catalog, cfg['site'], file_year, file_month, cycle_minutes=(0, 30))
     filtered_location_nightly_df = filtered_location_df.between_time(cfg['recording_start'], cfg['recording_end'], inclusive="left")
+    filtered_location_nightly_df = filter_df_to_night(filtered_location_nightly_df, cfg['site'], cfg)
 
     return filtered_location_nightly_df
 
@@ -873,15 +1037,18 @@ def run_pipeline_for_session_with_df(cfg):
     if (cfg['generate_fig']):
         data_params['resample_in_min'] = 30
         data_params['resample_tag'] = f"{data_params['resample_in_min']}T"
-        construct_activity_arr(cfg, data_params)
+        activity_dets_arr = construct_activity_arr(cfg, data_params)
+        figure_params = {key : data_params[key] for key in ['site', 'recover_folder', 'audiomoth_folder', 'output_dir', 'resample_tag']}
+        figure_params['show_PST'] = False
+        figure_jobs = []
         for group in ['', 'LF', 'HF']:
-            activity_df = shape_activity_array_into_grid(cfg, data_params, group)
-            plot_activity_grid(activity_df, data_params, group, save=True)
+            activity_df = shape_activity_array_into_grid(cfg, data_params, group, num_dets=activity_dets_arr)
+            figure_jobs += [{'kind': 'activity_grid', 'plot_df': activity_df, 'data_params': figure_params, 'group': group}]
             if data_params["site"] != "(Site not found in Field Records)":
                 data_params['selection_of_dates'] = 'recover-2024*'
                 cumulative_activity_df = construct_cumulative_activity(data_params, cfg, group)
-                data_params['show_PST'] = False
-                plot_cumulative_activity(cumulative_activity_df, data_params, group)
+                figure_jobs += [{'kind': 'cumulative', 'plot_df': cumulative_activity_df, 'data_params': figure_params, 'group': group}]
+        render_figures(figure_jobs, cfg)
 
     return bd_preds
 
@@ -891,11 +1058,10 @@ def get_params_relevant_to_data(cfg):
     data_params["audiomoth_folder"] = f"UBNA_{cfg['sd_unit']}"
     print(f"Searching for files from {cfg['recover_folder']} and {data_params['audiomoth_folder']}")
 
-    cur_data_records = dd.read_csv(f'{Path(__file__).parent}/../output_dir/ubna_data_04_collected_audio_records.csv', dtype=str).compute()
-    if 'Unnamed: 0' in cur_data_records.columns:
-        cur_data_records.drop(columns='Unnamed: 0', inplace=True)
-    cur_data_records["datetime_UTC"] = pd.DatetimeIndex(cur_data_records["datetime_UTC"])
-    cur_data_records.set_index("datetime_UTC", inplace=True) 
+    catalog = open_audio_catalog(cfg)
+    cur_data_records = audio_catalog.query_deployment_session(catalog, data_params['recover_folder'], cfg['sd_unit'],
+                                                              source='ubna_data_04_collected_audio_records.csv')
+    catalog.close()
     
     files_from_deployment_session = filter_df_with_deployment_session(cur_data_records, data_params['recover_folder'], cfg)
     site_name = files_from_deployment_session["site_name"].values[0]
@@ -936,6 +1102,9 @@ def filter_df_with_deployment_session(ubna_data_df, recover_folder, cfg):
     all_errors_cond = np.logical_and((filtered_location_df["file_duration"]!='Is empty!'), file_error_cond)
     filtered_location_df = filtered_location_df.loc[datetime_cond&all_errors_cond].sort_index()
     filtered_location_nightly_df = filtered_location_df.between_time(cfg['recording_start'], cfg['recording_end'], inclusive="left")
+    if not filtered_location_nightly_df.empty:
+        cfg['night_site'] = filtered_location_nightly_df["site_name"].values[0]
+        filtered_location_nightly_df = filter_df_to_night(filtered_location_nightly_df, cfg['night_site'], cfg)
 
     return filtered_location_nightly_df
 
@@ -1073,6 +1242,46 @@ def parse_args():
         type=int,
         default=4,
     )
+    parser.add_argument(
+        "--catalog_path",
+        type=str,
+        help="the audio catalog built from the collected audio records; defaults to the catalog file_dealer.py writes (audio_catalog.DEFAULT_CATALOG_PATH)",
+        default="none",
+    )
+    parser.add_argument(
+        "--night_only",
+        action="store_true",
+        help="Only process recordings and segments that overlap the civil night (dusk to dawn) at the site",
+    )
+    parser.add_argument(
+        "--night_margin",
+        type=float,
+        help="The minutes before civil dusk and after civil dawn that still count as night",
+        default=30,
+    )
+    parser.add_argument(
+        "--energy_gate",
+        action="store_true",
+        help="Skip segments without a train of calls above the noise floor in the LF and HF bands of the site",
+    )
+    parser.add_argument(
+        "--energy_gate_db",
+        type=float,
+        help="How far (dB) above the noise floor of the segment a frame has to rise to count as active",
+        default=energy_gate.DEFAULT_THRESHOLD_DB,
+    )
+    parser.add_argument(
+        "--energy_gate_calls",
+        type=int,
+        help="How many calls (runs of active frames) a band needs for a segment to be processed",
+        default=energy_gate.DEFAULT_MIN_CALLS,
+    )
+    parser.add_argument(
+        "--cumulative_store_dir",
+        type=str,
+        help="the directory of the per-site cumulative activity store",
+        default="none",
+    )
     return vars(parser.parse_args())
 
 
@@ -1098,6 +1307,15 @@ if __name__ == "__main__":
     cfg["should_csv"] = args["csv"]
     cfg["skip_existing"] = args['skip_existing']
     cfg["num_processes"] = args["num_processes"]
+    cfg["night_only"] = args["night_only"]
+    cfg["night_margin"] = args["night_margin"]
+    cfg["energy_gate"] = args["energy_gate"]
+    cfg["energy_gate_db"] = args["energy_gate_db"]
+    cfg["energy_gate_calls"] = args["energy_gate_calls"]
+    if args["catalog_path"] != "none":
+        cfg["catalog_path"] = Path(args["catalog_path"])
+    if args["cumulative_store_dir"] != "none":
+        cfg["cumulative_store_dir"] = Path(args["cumulative_store_dir"])
 
     if cfg['input_audio']!='none':
         if Path(cfg['input_audio']).is_file():
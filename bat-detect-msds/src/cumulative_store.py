@@ -0,0 +1,168 @@
+import json
+import fnmatch
+import hashlib
+from pathlib import Path
+
+import pandas as pd
+import pyarrow.dataset as ds
+
+# Append-only Parquet store of the activity arrays written by construct_activity_arr(), one
+# file per deployment session under <site>/<recover folder>/, keyed by date_and_time_UTC.
+# The cumulative activity grid of each group and resample tag is kept next to it and only the
+# dates covered by new or changed sessions are resampled and pivoted again.
+
+DEFAULT_STORE_DIR = Path(__file__).parent / "../output_dir/cumulative_store"
+
+
+def get_site_store(store_dir, site):
+    """
+    Returns the directory of the cumulative store of a site, creating it if needed.
+    """
+
+    site_dir = Path(store_dir) / site
+    site_dir.mkdir(parents=True, exist_ok=True)
+    return site_dir
+
+
+def _read_activity_csv(csv_path):
+    activity_df = pd.read_csv(csv_path)
+    activity_df["date_and_time_UTC"] = pd.to_datetime(activity_df["date_and_time_UTC"], format="%Y-%m-%d %H:%M:%S%z")
+    for column in activity_df.columns.drop("date_and_time_UTC"):
+        activity_df[column] = activity_df[column].astype('float64')
+    return activity_df.sort_values("date_and_time_UTC")
+
+
+def sync_activity_csvs(site_dir, csv_paths):
+    """
+    Adds the activity__*.csv files of a site that are new or changed since they were last added.
+
+    Parameters
+    ------------
+    site_dir : `pathlib.Path`
+        - The directory of the cumulative store of the site
+    csv_paths : `List`
+        - The activity__*.csv files of the site, each inside its <recover folder>/<site>/ directory
+
+    Returns
+    ------------
+    changed_parts : `List`
+        - The session files of the store that were written
+    """
+
+    changed_parts = []
+    for csv_path in csv_paths:
+        csv_path = Path(csv_path)
+        part_path = site_dir / csv_path.parent.parent.name / f"{csv_path.stem}.parquet"
+        if part_path.is_file() and part_path.stat().st_mtime >= csv_path.stat().st_mtime:
+            continue
+
+        part_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = part_path.with_suffix('.parquet.tmp')
+        _read_activity_csv(csv_path).to_parquet(tmp_path, index=False)
+        tmp_path.replace(part_path)
+        changed_parts += [part_path]
+
+    return changed_parts
+
+
+def _grid_paths(site_dir, selection_of_dates, group, resample_tag, recording_start, recording_end):
+    key = json.dumps([selection_of_dates, group, resample_tag, recording_start, recording_end])
+    grid_name = f"grid__{group}{resample_tag}_{hashlib.sha1(key.encode()).hexdigest()[:12]}"
+    return site_dir / "grids" / f"{grid_name}.parquet", site_dir / "grids" / f"{grid_name}.json"
+
+
+def _pivot_activity(activity_df, group, resample_tag, recording_start, recording_end):
+    """
+    Resamples activity arrays and pivots them into a (time of day x date) grid, as construct_cumulative_activity() did.
+    """
+
+    resampled_df = activity_df.resample(resample_tag, on="date_and_time_UTC").sum().between_time(recording_start, recording_end, inclusive='left')
+
+    activity_datetimes = pd.to_datetime(resampled_df.index.values)
+    raw_dates = activity_datetimes.date
+    raw_times = activity_datetimes.strftime("%H:%M")
+    if group!='':
+        mask = resampled_df.columns.str.contains(f'{group}.*')
+        selected_group = resampled_df.loc[:,mask]
+        if selected_group.shape[1]>2:
+            middle_col = selected_group.iloc[:,1]
+            middle_col.loc[middle_col<=1.0] = 0
+        data = list(zip(raw_dates, raw_times, selected_group.sum(axis=1)))
+    else:
+        data = list(zip(raw_dates, raw_times, resampled_df[f'{group}num_of_detections']))
+    activity = pd.DataFrame(data, columns=["Date (UTC)", "Time (UTC)", f'{group}num_of_detections'])
+    grid_df = activity.pivot(index="Time (UTC)", columns="Date (UTC)", values=f'{group}num_of_detections')
+    grid_df.columns = pd.to_datetime(grid_df.columns).strftime('%Y-%m-%d')
+
+    return grid_df
+
+
+def update_cumulative_grid(site_dir, selection_of_dates, group, resample_tag, recording_start, recording_end):
+    """
+    Brings the cumulative activity grid of a site up to date with the sessions in its store.
+    Only the dates covered by sessions added or changed since the last update are read and pivoted again;
+    the grid is rebuilt from every session if one was removed.
+
+    Parameters
+    ------------
+    site_dir : `pathlib.Path`
+        - The directory of the cumulative store of the site
+    selection_of_dates : `str`
+        - The glob pattern of the recover-DATE folders to include, like recover-2024*
+    group : `str`
+        - The frequency group: '', 'LF' or 'HF'
+    resample_tag : `str`
+        - The resample_tag associated with resampling: choose above 30T like 1H, 2H or D.
+    recording_start : `str`
+        - The first time of day (UTC) kept in the grid
+    recording_end : `str`
+        - The time of day (UTC) the grid ends before
+
+    Returns
+    ------------
+    activity_df : `pd.DataFrame`
+        - Rows corresponding to the time of day, columns to the dates (MM/DD/YY), values to the number of detections
+    """
+
+    part_paths = sorted(part_path for part_path in site_dir.glob("*/*.parquet")
+                        if fnmatch.fnmatch(part_path.parent.name, selection_of_dates))
+    part_mtimes = {str(part_path.relative_to(site_dir)): part_path.stat().st_mtime for part_path in part_paths}
+
+    grid_path, state_path = _grid_paths(site_dir, selection_of_dates, group, resample_tag, recording_start, recording_end)
+    if grid_path.is_file() and state_path.is_file():
+        known_mtimes = json.loads(state_path.read_text())
+        grid_df = pd.read_parquet(grid_path)
+    else:
+        known_mtimes = dict()
+        grid_df = pd.DataFrame()
+
+    if set(known_mtimes) - set(part_mtimes):
+        known_mtimes = dict()
+        grid_df = pd.DataFrame()
+    changed_parts = [site_dir / part for part, mtime in part_mtimes.items() if known_mtimes.get(part) != mtime]
+
+    if changed_parts:
+        changed_times = ds.dataset(changed_parts, format="parquet").to_table(columns=["date_and_time_UTC"]).column(0).to_pandas()
+        affected_dates = pd.DatetimeIndex(changed_times).tz_convert('UTC').normalize().unique()
+
+        # Every session with activity on an affected date contributes to its column
+        dataset = ds.dataset(part_paths, format="parquet")
+        date_filter = (ds.field("date_and_time_UTC") >= affected_dates.min()) & (ds.field("date_and_time_UTC") < affected_dates.max() + pd.Timedelta(days=1))
+        activity_df = dataset.to_table(filter=date_filter).to_pandas()
+        activity_df = activity_df.loc[activity_df["date_and_time_UTC"].dt.normalize().isin(affected_dates)]
+
+        new_columns_df = _pivot_activity(activity_df, group, resample_tag, recording_start, recording_end)
+        new_columns_df = new_columns_df.loc[:, new_columns_df.columns.isin(affected_dates.strftime('%Y-%m-%d'))]
+        grid_df = grid_df.drop(columns=[column for column in new_columns_df.columns if column in grid_df.columns])
+        grid_df = pd.concat([grid_df, new_columns_df], axis=1).sort_index(axis=0)
+        # Dates between sessions stay in the grid as columns without detections
+        all_dates = pd.date_range(min(grid_df.columns), max(grid_df.columns), freq='D').strftime('%Y-%m-%d')
+        grid_df = grid_df.reindex(columns=all_dates).fillna(0)
+
+        grid_path.parent.mkdir(parents=True, exist_ok=True)
+        grid_df.to_parquet(grid_path)
+        state_path.write_text(json.dumps(part_mtimes))
+
+    activity_df = grid_df.copy()
+    activity_df.columns = pd.to_datetime(activity_df.columns).strftime('%m/%d/%y')
+    return activity_df
@@ -0,0 +1,156 @@
+from functools import lru_cache
+
+import numpy as np
+import scipy.signal
+
+# Cheap pre-screen that runs before BatDetect2: each segment is passed through a small band-pass
+# filter bank (the bat frequency bands of FREQ_GROUPS) as it is read for segmentation, and the RMS
+# energy of consecutive frames is compared to the noise floor of the segment in each band. Runs of
+# active frames as long as a call are counted, and segments without a train of calls in any band
+# are not written to the tmp folder and never reach the CNN.
+# The defaults were tuned on synthetic 192kHz segments (FM calls, clicks, insect chorus, noise):
+# trains of 5+ calls at ~7dB above the band noise are kept, while noise, up to 10 clicks, a
+# pulsed 20kHz chorus and a single isolated call are skipped.
+
+# 256 samples are ~1.3ms at 192kHz, so a ~5ms search-phase call spans several frames
+DEFAULT_FRAME_LENGTH = 256
+
+# How far (dB) a frame has to rise above the noise floor of its band to count as active
+DEFAULT_THRESHOLD_DB = 6.0
+
+# How many consecutive active frames make a call; clicks and other transients only light up one frame
+DEFAULT_MIN_CALL_FRAMES = 2
+
+# How many calls a band needs for the segment to be kept; a bat pass is a train of calls
+DEFAULT_MIN_CALLS = 3
+
+# Order of the Butterworth band-pass filters; the gate only needs rough band edges
+FILTER_ORDER = 2
+
+
+@lru_cache(maxsize=None)
+def get_band_filters(samplerate, bands, order=FILTER_ORDER):
+    """
+    Designs the band-pass filter of each frequency band, clipping the bands to the Nyquist frequency.
+
+    Parameters
+    ------------
+    samplerate : `int`
+        - The sampling rate of the audio
+    bands : `tuple`
+        - The (low, high) frequency bounds (Hz) of each band, like the values of FREQ_GROUPS[site]
+    order : `int`
+        - The order of each Butterworth filter
+
+    Returns
+    ------------
+    band_filters : `List`
+        - The second-order sections of each band that lies below the Nyquist frequency
+    """
+
+    nyquist = samplerate / 2
+    band_filters = []
+    for low_freq, high_freq in bands:
+        high_freq = min(high_freq, 0.99 * nyquist)
+        if low_freq >= high_freq:
+            continue
+        if low_freq <= 0:
+            band_filters += [scipy.signal.butter(order, high_freq, btype='lowpass', fs=samplerate, output='sos')]
+        else:
+            band_filters += [scipy.signal.butter(order, [low_freq, high_freq], btype='bandpass', fs=samplerate, output='sos')]
+
+    return band_filters
+
+
+def compute_band_energies(audio, samplerate, bands, frame_length=DEFAULT_FRAME_LENGTH):
+    """
+    Computes the RMS energy of consecutive frames of audio within each frequency band.
+
+    Parameters
+    ------------
+    audio : `np.ndarray`
+        - The samples of a segment; multi-channel audio is averaged into one channel
+    samplerate : `int`
+        - The sampling rate of the audio
+    bands : `List`
+        - The [low, high] frequency bounds (Hz) of each band, like the values of FREQ_GROUPS[site]
+    frame_length : `int`
+        - The number of samples per frame
+
+    Returns
+    ------------
+    band_energies : `np.ndarray`
+        - Shape (number of frames, number of bands), the mean power of each frame within each band
+    """
+
+    if audio.ndim > 1:
+        audio = audio.mean(axis=1)
+    num_frames = len(audio) // frame_length
+    audio = np.asarray(audio[:num_frames*frame_length], dtype='float32')
+
+    band_filters = get_band_filters(samplerate, tuple(tuple(band) for band in bands))
+    band_energies = np.zeros((num_frames, len(band_filters)), dtype='float64')
+    for i, sos in enumerate(band_filters):
+        filtered = scipy.signal.sosfilt(sos.astype('float32'), audio)
+        band_energies[:, i] = np.square(filtered).reshape(num_frames, frame_length).mean(axis=1)
+
+    return band_energies
+
+
+def count_calls(band_energies, threshold_db=DEFAULT_THRESHOLD_DB, min_call_frames=DEFAULT_MIN_CALL_FRAMES):
+    """
+    Counts the calls in each band of a segment: runs of at least min_call_frames consecutive frames
+    above the noise floor. The noise floor of each band is the median frame energy of the segment,
+    so it follows the background noise of each night and site instead of a fixed level.
+
+    Parameters
+    ------------
+    band_energies : `np.ndarray`
+        - The band energies of the segment, from compute_band_energies()
+    threshold_db : `float`
+        - How far a frame has to rise above the noise floor of its band to count as active
+    min_call_frames : `int`
+        - How many consecutive active frames make a call
+
+    Returns
+    ------------
+    num_calls : `np.ndarray`
+        - The number of calls in each band
+    """
+
+    noise_floor = np.maximum(np.median(band_energies, axis=0), np.finfo('float64').tiny)
+    active = band_energies > noise_floor * (10 ** (threshold_db / 10))
+
+    # Rising and falling edges of the runs of active frames of each band
+    edges = np.diff(np.pad(active.astype('int8'), ((1, 1), (0, 0))), axis=0)
+    num_calls = np.zeros(active.shape[1], dtype='int64')
+    for i in range(active.shape[1]):
+        run_lengths = np.flatnonzero(edges[:, i] == -1) - np.flatnonzero(edges[:, i] == 1)
+        num_calls[i] = (run_lengths >= min_call_frames).sum()
+
+    return num_calls
+
+
+def gate_segment(band_energies, threshold_db=DEFAULT_THRESHOLD_DB, min_calls=DEFAULT_MIN_CALLS):
+    """
+    Decides whether a segment holds a train of calls worth running the detector on.
+
+    Parameters
+    ------------
+    band_energies : `np.ndarray`
+        - The band energies of the segment, from compute_band_energies()
+    threshold_db : `float`
+        - How far a frame has to rise above the noise floor of its band to count as active
+    min_calls : `int`
+        - How many calls (see count_calls()) a band needs for the segment to be kept
+
+    Returns
+    ------------
+    keep : `bool`
+        - True if any band has at least min_calls calls; segments too short to measure are kept
+    """
+
+    if band_energies.size == 0:
+        return True
+
+    return bool((count_calls(band_energies, threshold_db) >= min_calls).any())
@@ -1,13 +1,16 @@
 import argparse
 import glob
+import struct
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import pandas as pd
 import datetime as dt
 import numpy as np
-import exiftool
 
+import audio_catalog
 import batdt2_pipeline as batdetect2_pipeline
+from utils.wav_header import read_wav_header
 
 def get_recover_folder_from_filepath(filepath):
     if "recover" in str(filepath.parents[1]):
@@ -60,13 +63,56 @@ def get_file_status(comment):
     else:
         return "Usable for detection"
     
-def get_file_comment(filepath):
-    if not(filepath.exists()):
-        return "Does not exist!"
-    if filepath.stat().st_size == 0:
+def get_file_comment(filepath, file_stat=None):
+    if file_stat is None:
+        if not(filepath.exists()):
+            return "Does not exist!"
+        file_stat = filepath.stat()
+    if file_stat.st_size == 0:
         return "Is empty!"
     
     return "good!"
+
+def get_file_metadata(filepath):
+    """Reads the Audiomoth-related metadata of a .WAV file from its RIFF header.
+
+    Parameters
+    ------------
+    filepath : `pathlib.Path`
+        - The path to the .WAV file
+
+    Returns
+    ------------
+    metadata : `tuple`
+        - The comment, sample rate, artist and duration of the file in that order.
+        - Each value is replaced by a status message when the file is missing, empty
+        or the header does not contain it.
+    """
+
+    try:
+        file_stat = filepath.stat()
+    except FileNotFoundError:
+        return ("Does not exist!", "Does not exist!", "Does not exist!", "Does not exist!")
+
+    file_comment = get_file_comment(filepath, file_stat)
+    if file_comment != "good!":
+        return (file_comment, file_comment, file_comment, file_comment)
+
+    try:
+        header = read_wav_header(filepath)
+    except (OSError, ValueError, struct.error):
+        error_comment = "File has no comment due to error!"
+        return (error_comment, error_comment, error_comment, error_comment)
+
+    no_audiomoth_comment = "File has no Audiomoth-related comment"
+    metadata = []
+    for key in ["comment", "sample_rate", "artist", "duration"]:
+        if header[key] is None:
+            metadata += [no_audiomoth_comment]
+        else:
+            metadata += [header[key]]
+
+    return tuple(metadata)
     
 
 def generate_files_df(cfg):
@@ -77,63 +123,28 @@ def generate_files_df(cfg):
         if not('trash' in str(filepath).lower()):
             clean_files.append(filepath)
 
-    all_wav_files = sorted(clean_files)
+    records_csv_path = cfg['output_dir'] / cfg["csv_name"]
+    catalog = audio_catalog.connect_catalog(cfg.get("catalog_path", audio_catalog.DEFAULT_CATALOG_PATH))
+    if records_csv_path.is_file():
+        audio_catalog.sync_records_csvs(catalog, [records_csv_path])
+    catalogued_paths = audio_catalog.get_catalogued_paths(catalog)
+    new_files = [filepath for filepath in clean_files if str(filepath) not in catalogued_paths]
+    print(f"Found {len(new_files)} new files out of {len(clean_files)} files!")
+
+    all_wav_files = sorted(new_files)
     file_path_column_name = "file_path"
     files_df = pd.DataFrame((all_wav_files), columns=[file_path_column_name])
     print(f"Created file paths column!")
+
+    with ThreadPoolExecutor(max_workers=cfg.get("num_threads", 16)) as executor:
+        metadata = list(executor.map(get_file_metadata, all_wav_files))
+
     file_metadata_column_name = "file_metadata"
-    files_df[file_metadata_column_name] = files_df[file_path_column_name].apply(lambda x : get_file_comment(x))
-    print(f"Created file metadata column!")
-    files_df["sample_rate"] = files_df[file_path_column_name].apply(lambda x : get_file_comment(x))
-    print(f"Created sample rate column!")
-    files_df["audiomoth_artist_ID"] = files_df[file_path_column_name].apply(lambda x : get_file_comment(x))
-    print(f"Created Audiomoth artist ID column!")
-    files_df["file_duration"] = files_df[file_path_column_name].apply(lambda x : get_file_comment(x))
-    print(f"Created file duration column!")
-
-    with exiftool.ExifToolHelper() as et:
-        good_paths = list(files_df.loc[files_df[file_metadata_column_name] == "good!"][file_path_column_name].values)
-        comments = []
-        sample_rates = []
-        artists = []
-        durations = []
-        for path in good_paths:
-            try:
-                raw_data = et.get_metadata(path)
-                datapoint = raw_data[0]
-                no_audiomoth_comment = "File has no Audiomoth-related comment"
-
-                if "Composite:Duration" in datapoint.keys():
-                    durations += [(datapoint["Composite:Duration"])]
-                else:
-                    durations += [no_audiomoth_comment]
-
-                if "RIFF:SampleRate" in datapoint.keys():
-                    sample_rates += [datapoint["RIFF:SampleRate"]]
-                else:
-                    sample_rates += [no_audiomoth_comment]
-
-                if "RIFF:Comment" in datapoint.keys():
-                    comments += [datapoint["RIFF:Comment"]]
-                else:
-                    comments += [no_audiomoth_comment]
-
-                if "RIFF:Artist" in datapoint.keys():
-                    artists += [datapoint["RIFF:Artist"]]
-                else:
-                    artists += [no_audiomoth_comment]
-            except exiftool.exceptions.ExifToolExecuteError:
-                error_comment = "File has no comment due to error!"
-                artists += [error_comment]
-                sample_rates += [error_comment]
-                comments += [error_comment]
-                durations += [error_comment]
-
-        files_df[file_metadata_column_name].loc[files_df[file_metadata_column_name] == "good!"] = comments
-        files_df["sample_rate"].loc[files_df["sample_rate"] == "good!"] = sample_rates
-        files_df["audiomoth_artist_ID"].loc[files_df["audiomoth_artist_ID"] == "good!"] = artists
-        files_df["file_duration"].loc[files_df["file_duration"] == "good!"] = durations
-    
+    metadata_columns = [file_metadata_column_name, "sample_rate", "audiomoth_artist_ID", "file_duration"]
+    metadata_df = pd.DataFrame(metadata, columns=metadata_columns, index=files_df.index, dtype=object)
+    files_df[metadata_columns] = metadata_df
+    print(f"Created file metadata, sample rate, Audiomoth artist ID and file duration columns!")
+
     print(f"Updated file metadata info using Audiomoth metadata comments!")
     files_df.insert(2, "audiomoth_battery", files_df[file_metadata_column_name].apply(lambda x : get_file_battery(x)))
     print(f"Created Audiomoth battery column!")
@@ -174,7 +185,14 @@ def generate_files_df(cfg):
     files_df.insert(0, "datetime_UTC", pd.to_datetime(files_df[file_path_column_name], format="%Y%m%d_%H%M%S", exact=False))
     print(f"Created datetime column!")
 
-    files_df.to_csv(cfg['output_dir'] / cfg["csv_name"])
+    if records_csv_path.is_file():
+        files_df.index += audio_catalog.count_source_rows(catalog, cfg["csv_name"])
+        files_df.to_csv(records_csv_path, mode='a', header=False)
+    else:
+        files_df.to_csv(records_csv_path)
+    audio_catalog.append_files_df(catalog, files_df, cfg["csv_name"])
+    audio_catalog.record_source(catalog, records_csv_path)
+    catalog.close()
 
     return files_df
 
@@ -420,6 +438,18 @@ def parse_args():
         type=str,
         help="the name of the csv that will contain info"
     )
+    parser.add_argument(
+        "--num_threads",
+        type=int,
+        help="the number of threads reading file headers at once",
+        default=16,
+    )
+    parser.add_argument(
+        "--catalog_path",
+        type=str,
+        help="the audio catalog to add new files to; defaults to the catalog batdt2_pipeline.py reads (audio_catalog.DEFAULT_CATALOG_PATH)",
+        default="none",
+    )
 
     return vars(parser.parse_args())
 
@@ -430,5 +460,8 @@ if __name__ == "__main__":
     cfg["output_dir"] = Path(args["output_directory"])
     cfg["input_dir"] = Path(args["input_dir"])
     cfg["csv_name"] = args["csv_name"]
+    cfg["num_threads"] = args["num_threads"]
+    if args["catalog_path"] != "none":
+        cfg["catalog_path"] = Path(args["catalog_path"])
 
     files_df = generate_files_df(cfg)
\ No newline at end of file
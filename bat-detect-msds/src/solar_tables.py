@@ -0,0 +1,307 @@
+import argparse
+import glob
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import suncalc
+
+# Sunrise, sunset and twilight times of every date of a year at a recording site, computed once
+# with a single vectorized suncalc call and kept as a .csv file per site and year. Plots, the
+# dashboard and the job schedulers read these tables instead of recomputing solar positions.
+
+SEATTLE_LATITUDE = 47.655181
+SEATTLE_LONGITUDE = -122.293123
+
+# The suncalc events that bound civil night: civil dusk to civil dawn
+CIVIL_DUSK = "dusk"
+CIVIL_DAWN = "dawn"
+
+SITES_CSV_PATH = Path(__file__).parent / "../../osn_bucket_metadata/ubna_recording_sites.csv"
+# The file listings of the OSN bucket that record the site of every recording (file, site, sample_rate)
+SITE_LISTS_GLOB = str(Path(__file__).parent / "../../osn_bucket_metadata/*_wav_files.csv")
+DEFAULT_TABLE_DIR = Path(__file__).parent / "../output_dir/solar_tables"
+
+
+@lru_cache(maxsize=None)
+def get_site_coordinates(site):
+    """
+    Returns the (latitude, longitude) of a recording site from ubna_recording_sites.csv.
+    Sites that are not listed fall back to the coordinates of Seattle.
+    """
+
+    if SITES_CSV_PATH.is_file():
+        sites_df = pd.read_csv(SITES_CSV_PATH, index_col="Site")
+        if site in sites_df.index:
+            return float(sites_df.loc[site, "Latitude_Avg"]), float(sites_df.loc[site, "Longitude_Avg"])
+
+    return SEATTLE_LATITUDE, SEATTLE_LONGITUDE
+
+
+def compute_solar_table(latitude, longitude, year):
+    """
+    Computes the solar events of every date of a year at a location.
+
+    Parameters
+    ------------
+    latitude : `float`
+        - The latitude of the location
+    longitude : `float`
+        - The longitude of the location
+    year : `int`
+        - The year to compute the table for
+
+    Returns
+    ------------
+    solar_df : `pd.DataFrame`
+        - Indexed by date (UTC midnight), with one column of UTC times per suncalc event
+        (solar_noon, sunrise, sunrise_end, sunset_start, sunset, dawn, dusk, ...)
+    """
+
+    dates = pd.date_range(f"{year}-01-01", f"{year}-12-31", freq="D").as_unit("ns")
+    solar_times = suncalc.get_times(dates, np.full(len(dates), longitude), np.full(len(dates), latitude))
+    solar_df = pd.DataFrame({event : pd.DatetimeIndex(times) for event, times in solar_times.items()})
+    solar_df.index = pd.Index(dates, name="date")
+
+    return solar_df
+
+
+@lru_cache(maxsize=64)
+def get_solar_table(site, year, table_dir=DEFAULT_TABLE_DIR):
+    """
+    Returns the solar events table of a site and year, computing and saving it on first use.
+
+    Parameters
+    ------------
+    site : `str`
+        - The site name as it appears in ubna_recording_sites.csv
+    year : `int`
+        - The year of the table
+    table_dir : `str` or `pathlib.Path`
+        - The directory the tables are kept in
+
+    Returns
+    ------------
+    solar_df : `pd.DataFrame`
+        - The table described in compute_solar_table()
+    """
+
+    table_path = Path(table_dir) / f"solar_events__{site.replace(' ', '_')}_{year}.csv"
+    if table_path.is_file():
+        solar_df = pd.read_csv(table_path, index_col="date", parse_dates=True)
+        return solar_df.apply(lambda times : pd.to_datetime(times, utc=True))
+
+    latitude, longitude = get_site_coordinates(site)
+    solar_df = compute_solar_table(latitude, longitude, year)
+    table_path.parent.mkdir(parents=True, exist_ok=True)
+    solar_df.to_csv(table_path)
+
+    return solar_df
+
+
+def get_solar_events(site, dates, table_dir=DEFAULT_TABLE_DIR):
+    """
+    Looks up the solar events of a site for a list of dates.
+
+    Parameters
+    ------------
+    site : `str`
+        - The site name as it appears in ubna_recording_sites.csv
+    dates : `pd.DatetimeIndex`
+        - The dates to look up; times of day are ignored
+
+    Returns
+    ------------
+    solar_df : `pd.DataFrame`
+        - One row of solar events per date, in the order of dates
+    """
+
+    dates = pd.DatetimeIndex(dates)
+    if dates.tz is not None:
+        dates = dates.tz_convert("UTC").tz_localize(None)
+    dates = dates.normalize()
+    solar_df = pd.concat([get_solar_table(site, year, table_dir) for year in sorted(set(dates.year))])
+
+    return solar_df.reindex(dates.as_unit(solar_df.index.unit))
+
+
+def get_night_mask(site, datetimes, margin=pd.Timedelta(0), dusk_event="sunset_start", dawn_event="sunrise_end",
+                   table_dir=DEFAULT_TABLE_DIR):
+    """
+    Tells which datetimes fall outside of daylight (by default sunrise_end to sunset_start) at a site.
+
+    Parameters
+    ------------
+    site : `str`
+        - The site name as it appears in ubna_recording_sites.csv
+    datetimes : `pd.DatetimeIndex`
+        - The times to check; naive times are taken as UTC
+    margin : `pd.Timedelta`
+        - How far the night is extended into daylight before sunset and after sunrise
+    dusk_event : `str`
+        - The suncalc event the night starts at, like CIVIL_DUSK
+    dawn_event : `str`
+        - The suncalc event the night ends at, like CIVIL_DAWN
+
+    Returns
+    ------------
+    is_night : `np.ndarray` of `bool`
+        - True for every datetime at night
+    """
+
+    datetimes = pd.DatetimeIndex(datetimes)
+    if datetimes.tz is None:
+        datetimes = datetimes.tz_localize("UTC")
+    datetimes = datetimes.tz_convert("UTC")
+    if len(datetimes) == 0:
+        return np.zeros(0, dtype=bool)
+
+    # Each time belongs to the day whose solar noon is closest
+    naive_dates = datetimes.tz_localize(None).normalize()
+    first_date, last_date = naive_dates.min() - pd.Timedelta(days=1), naive_dates.max() + pd.Timedelta(days=1)
+    solar_df = get_solar_events(site, pd.date_range(first_date, last_date, freq="D"), table_dir)
+    query_times = datetimes.as_unit("ns").asi8
+    solar_noons = pd.DatetimeIndex(solar_df["solar_noon"]).as_unit("ns").asi8
+    after = np.clip(np.searchsorted(solar_noons, query_times), 1, len(solar_noons) - 1)
+    closest = np.where(query_times - solar_noons[after - 1] < solar_noons[after] - query_times, after - 1, after)
+
+    day_start = pd.DatetimeIndex(solar_df[dawn_event]).as_unit("ns").asi8[closest] + margin.value
+    day_end = pd.DatetimeIndex(solar_df[dusk_event]).as_unit("ns").asi8[closest] - margin.value
+
+    return (query_times < day_start) | (query_times >= day_end)
+
+
+def get_recording_night_mask(site, start_times, duration, margin=pd.Timedelta(0), table_dir=DEFAULT_TABLE_DIR):
+    """
+    Tells which recordings overlap the civil night (civil dusk to civil dawn) at a site.
+
+    Parameters
+    ------------
+    site : `str`
+        - The site name as it appears in ubna_recording_sites.csv
+    start_times : `pd.DatetimeIndex`
+        - The UTC start times of the recordings
+    duration : `pd.Timedelta`
+        - The length of the recordings
+    margin : `pd.Timedelta`
+        - How far the night is extended into daylight before dusk and after dawn
+
+    Returns
+    ------------
+    is_night : `np.ndarray` of `bool`
+        - True for every recording that starts or ends at night; recordings without a start time are kept
+    """
+
+    start_times = pd.DatetimeIndex(start_times)
+    is_night = np.ones(len(start_times), dtype=bool)
+    has_time = ~start_times.isna()
+    if has_time.any():
+        known_starts = start_times[has_time]
+        is_night[has_time] = (get_night_mask(site, known_starts, margin, CIVIL_DUSK, CIVIL_DAWN, table_dir)
+                              | get_night_mask(site, known_starts + duration, margin, CIVIL_DUSK, CIVIL_DAWN, table_dir))
+
+    return is_night
+
+
+def get_file_start_times(file_paths):
+    """
+    Parses the UTC start times from AudioMoth file names (YYYYMMDD_HHMMSS.WAV); unparseable names give NaT.
+    """
+
+    file_names = [Path(file_path).name for file_path in file_paths]
+    return pd.DatetimeIndex(pd.to_datetime(file_names, format="%Y%m%d_%H%M%S", exact=False, errors="coerce"))
+
+
+def get_file_sites(file_paths, site_lists):
+    """
+    Looks up the recording site of each file in the OSN bucket file listings.
+    Files are matched on their last three path components (recover-YYYYMMDD/UBNA_XXX/YYYYMMDD_HHMMSS.WAV),
+    so the listings match no matter where the bucket is mounted.
+
+    Parameters
+    ------------
+    file_paths : `List`
+        - The paths of the recordings
+    site_lists : `List`
+        - The .csv listings with file and site columns, like ubna05_wav_files.csv
+
+    Returns
+    ------------
+    sites : `List`
+        - The site of each recording; None for recordings that are not listed
+    """
+
+    file_sites = {}
+    for site_list in site_lists:
+        sites_df = pd.read_csv(site_list, usecols=["file", "site"]).dropna()
+        file_sites.update(zip(sites_df["file"].map(lambda file : "/".join(Path(file).parts[-3:])), sites_df["site"]))
+
+    return [file_sites.get("/".join(Path(file_path).parts[-3:])) for file_path in file_paths]
+
+
+def parse_args():
+    """
+    Defines the command line interface that filters a list of recordings to the ones made at night.
+    """
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--file_list",
+        type=str,
+        help="A text file listing one recording per line, like usable_files.txt",
+    )
+    parser.add_argument(
+        "--output_list",
+        type=str,
+        help="The text file the recordings made at night are written to",
+    )
+    parser.add_argument(
+        "--site",
+        type=str,
+        help="The site of the recordings that are not in a --site_list; unknown sites use the coordinates of Seattle",
+        default="none",
+    )
+    parser.add_argument(
+        "--site_list",
+        type=str,
+        nargs="*",
+        help="The .csv listings that give the site of each recording",
+        default=sorted(glob.glob(SITE_LISTS_GLOB)),
+    )
+    parser.add_argument(
+        "--night_margin",
+        type=float,
+        help="The minutes before civil dusk and after civil dawn that still count as night",
+        default=30,
+    )
+    parser.add_argument(
+        "--duration",
+        type=int,
+        help="The length of the recordings in seconds",
+        default=1795,
+    )
+    return vars(parser.parse_args())
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    with open(args["file_list"], "r") as f:
+        file_paths = [line.strip() for line in f if line.strip()]
+
+    sites = pd.Series(get_file_sites(file_paths, args["site_list"]), dtype=object)
+    print(f"{sites.isna().sum()} recordings without a listed site use the site {args['site']}.")
+    sites = sites.fillna(args["site"])
+
+    start_times = get_file_start_times(file_paths)
+    is_night = np.ones(len(file_paths), dtype=bool)
+    for site, site_index in sites.groupby(sites).groups.items():
+        is_night[site_index] = get_recording_night_mask(site, start_times[site_index], pd.Timedelta(seconds=args["duration"]),
+                                                        pd.Timedelta(minutes=args["night_margin"]))
+
+    with open(args["output_list"], "w") as f:
+        for file_path in np.array(file_paths, dtype=object)[is_night]:
+            f.write(f"{file_path}\n")
+
+    print(f"{is_night.sum()} recordings at night, {(~is_night).sum()} daytime recordings skipped.")
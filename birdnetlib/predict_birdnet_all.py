@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 import csv
 import concurrent.futures
@@ -24,8 +25,17 @@ custom_species_list_path = Path.cwd() / "custom_species_list" / "washington_spec
 # Initialize BirdNET-Analyzer model with the custom species list
 model = Analyzer(custom_species_list_path=str(custom_species_list_path))
 
+# Only process the files listed in AUDIO_FILE_LIST (new recordings, see docker_runs/run_frognet.sh)
+# or every .WAV file in the folder if no list is given
+audio_file_list = os.environ.get("AUDIO_FILE_LIST")
+if audio_file_list:
+    with open(audio_file_list) as f:
+        audio_files = [audio_folder / name for name in f.read().splitlines() if name.endswith(".WAV")]
+else:
+    audio_files = audio_folder.glob("*.WAV")
+
 # Process each .wav file in the folder
-for audio_file in sorted(audio_folder.glob("*.WAV")):
+for audio_file in sorted(audio_files):
     print(f"\n Processing: {audio_file.name}")
 
     # Create a Recording object (without lat/lon filtering to avoid empty results)
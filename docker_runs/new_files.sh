@@ -0,0 +1,60 @@
+#!/bin/bash
+
+# Prints the names of the files inside a directory that the models should process: the files of the list
+# given as second argument (like night_files.txt), the usable files listed in usable_files.txt by
+# validate_new_files.py, or the new files listed in new_files.txt by new_data1.py.
+# Falls back to every .WAV file in the directory if none of the lists exist.
+files_in_directory() {
+  local directory="${1%/}"
+  local file_list="${2:-usable_files.txt}"
+
+  if [ ! -f "$file_list" ]; then
+    file_list=usable_files.txt
+  fi
+
+  if [ ! -f "$file_list" ]; then
+    file_list=new_files.txt
+  fi
+
+  if [ ! -f "$file_list" ]; then
+    find "$directory" -maxdepth 1 -type f -name "*.WAV" -printf "%f\n" | sort
+    return
+  fi
+
+  awk -v dir="$directory" '{
+    file_dir = $0
+    sub(/\/[^\/]*$/, "", file_dir)
+    if (file_dir == dir) {
+      sub(/^.*\//, "")
+      print
+    }
+  }' "$file_list"
+}
+
+# Writes night_files.txt: the files of usable_files.txt (or new_files.txt) that overlap the civil night
+# (dusk to dawn, plus NIGHT_MARGIN minutes) at their recording sites, using solar_tables.py in the
+# bat-detect-msds image. The site of each file is looked up in the osn_bucket_metadata listings;
+# files that are not listed use NIGHT_SITE. Only runs with NIGHT_ONLY=1, otherwise the bat models
+# process every usable file.
+write_night_files() {
+  local file_list=usable_files.txt
+
+  rm -f night_files.txt
+  if [ "${NIGHT_ONLY:-0}" != 1 ]; then
+    return
+  fi
+  if [ ! -f "$file_list" ]; then
+    file_list=new_files.txt
+  fi
+  if [ ! -f "$file_list" ]; then
+    return
+  fi
+
+  docker run --rm \
+      --mount type=bind,source="$PWD",target=/app/file_lists/ \
+      bat-detect-msds:latest python3 /app/bat-detect-msds/src/solar_tables.py \
+      --file_list="/app/file_lists/$file_list" \
+      --output_list="/app/file_lists/night_files.txt" \
+      --site="${NIGHT_SITE:-none}" \
+      --night_margin="${NIGHT_MARGIN:-30}"
+}
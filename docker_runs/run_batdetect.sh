@@ -1,5 +1,16 @@
 #!/bin/bash
 
+source "$(dirname "$0")/new_files.sh"
+
+# Bats are only active at night; with NIGHT_ONLY=1 the recordings made during the day are skipped
+write_night_files
+
+# With ENERGY_GATE=1 segments without a train of calls in the bat bands are not run through BatDetect2
+gate_args=()
+if [ "${ENERGY_GATE:-0}" = 1 ]; then
+  gate_args=(--energy_gate)
+fi
+
 # Loop through each directory in new_directories.txt
 while IFS= read -r directory; do
   echo "Running Docker on directory:" $directory
@@ -8,12 +19,11 @@ while IFS= read -r directory; do
       echo "Skipping empty directory."
       continue
   fi
-files=($(find "$directory" -type f))  # List of all files in the directory
+  files=($(files_in_directory "$directory" night_files.txt))  # List of the new files in the directory
 
   # Iterate through all of the files to check whether they are .WAV format
   for ((i=0; i<${#files[@]}; i++)); do
-    file="${files[$i]}"
-    filename=$(basename "$file")  # Get the filename
+    filename="${files[$i]}"
 
     # Check if the file ends with .WAV 
     if [[ "$filename" == *.WAV ]]; then
@@ -26,11 +36,11 @@ files=($(find "$directory" -type f))  # List of all files in the directory
             --mount type=bind,source=/mnt/ecoacoustic-storage,target=/app/output_dir/ \
             bat-detect-msds:latest python3 /app/bat-detect-msds/src/batdt2_pipeline.py \
             --input_audio="/app/recordings_2023/$filename" \
-            --output_directory="/app/output_dir/" --run_model --csv
+            --output_directory="/app/output_dir/" --run_model --csv "${gate_args[@]}"
     else
         echo "Skipping non-WAV file: $filename"
     fi
     
   done
 
-done < new_directories.txt
\ No newline at end of file
+done < new_directories.txt
@@ -0,0 +1,41 @@
+#!/bin/bash
+
+# Runs BattyBirdNET on the new files of each directory; build the image first with
+# docker build -t battybirdnet ./BattyBirdNET-Analyzer
+
+source "$(dirname "$0")/new_files.sh"
+
+# Bats are only active at night; with NIGHT_ONLY=1 the recordings made during the day are skipped
+write_night_files
+
+# Loop through directories in new_directories.txt
+while IFS= read -r directory; do
+  echo "Running Docker on directory:" $directory
+
+  # skip empty directories
+  if [ -z "$(ls -A "$directory")" ]; then
+      echo "Skipping empty directory."
+      continue
+  fi
+
+  # list the new files of the directory so the model skips files that were already analyzed
+  file_list=$(mktemp)
+  files_in_directory "$directory" night_files.txt > "$file_list"
+  if [ ! -s "$file_list" ]; then
+      echo "Skipping directory without new files."
+      rm -f "$file_list"
+      continue
+  fi
+
+  # mount input directory to directory in docker container
+  # mount manila storage directory (/mnt/ecoacoustic-storage/) to the model output directory
+  docker run --rm \
+                --mount type=bind,source=$directory,target=/app/audio/ \
+                --mount type=bind,source=$file_list,target=/app/audio_file_list.txt,readonly \
+                --mount type=bind,source=/mnt/ecoacoustic-storage/,target=/app/output_dir/ \
+                battybirdnet:latest bash -c "source ~/.bashrc && python3 bat_ident.py \
+                --i /app/audio/ --o /app/output_dir/ --area USA --file_list /app/audio_file_list.txt"
+
+  rm -f "$file_list"
+
+done < new_directories.txt
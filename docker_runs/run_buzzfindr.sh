@@ -1,5 +1,10 @@
 #!/bin/bash
 
+source "$(dirname "$0")/new_files.sh"
+
+# Feeding buzzes are only recorded at night; with NIGHT_ONLY=1 the recordings made during the day are skipped
+write_night_files
+
 # Loop through each directory in new_directories.txt
 while IFS= read -r directory; do
   echo "Running Docker on directory:" $directory
@@ -9,14 +14,27 @@ while IFS= read -r directory; do
       continue
   fi
 
+  # copy only the new files of the directory into a staging directory, since buzzfindr
+  # processes (and renames) every file of the directory it is given
+  staging_dir=$(mktemp -d)
+  while IFS= read -r filename; do
+    cp "$directory/$filename" "$staging_dir/"
+  done < <(files_in_directory "$directory" night_files.txt)
+
+  if [ -z "$(ls -A "$staging_dir")" ]; then
+      echo "Skipping directory without new files."
+      rm -rf "$staging_dir"
+      continue
+  fi
+
   # Run Docker for each directory mounted to directory inside docker container
   # mount manila storage directory to model output directory
     docker run --rm \
-        --mount type=bind,source=$directory,target=/app/recordings_buzz/ \
+        --mount type=bind,source=$staging_dir,target=/app/recordings_buzz/ \
         --mount type=bind,source=/mnt/ecoacoustic-storage/,target=/app/output_buzz/ \
         buzzfindr-image:latest
 
-    # Remove Buzz_Results_ directories after processing
-    sudo rm -rf $directory/Buzz_Results_*
+    # Remove the staged files and Buzz_Results_ directories after processing
+    sudo rm -rf "$staging_dir"
 
-done < new_directories.txt
\ No newline at end of file
+done < new_directories.txt
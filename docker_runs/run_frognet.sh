@@ -1,4 +1,7 @@
 #!/bin/bash
+
+source "$(dirname "$0")/new_files.sh"
+
 # Loop through directories in new_directories.txt
 while IFS= read -r directory; do
   echo "Running Docker on directory:" $directory
@@ -8,13 +11,26 @@ while IFS= read -r directory; do
       echo "Skipping empty directory."
       continue
   fi
+
+  # list the new files of the directory so the models skip files that were already analyzed
+  file_list=$(mktemp)
+  files_in_directory "$directory" > "$file_list"
+  if [ ! -s "$file_list" ]; then
+      echo "Skipping directory without new files."
+      rm -f "$file_list"
+      continue
+  fi
   
   # mount input directory to directory in docker container
   # mount manila storage directory (/mnt/ecoacoustic-storage/) to each model output directory
   docker run --rm \
                 --mount type=bind,source=$directory,target=/app/audio/ \
+                --mount type=bind,source=$file_list,target=/app/audio_file_list.txt,readonly \
+                --env AUDIO_FILE_LIST=/app/audio_file_list.txt \
                 --mount type=bind,source=/mnt/ecoacoustic-storage/,target=/app/results/frogs/ \
                 --mount type=bind,source=/mnt/ecoacoustic-storage/,target=/app/results/birdnet_wa_all/ \
                 frog_bird:latest
 
-done < new_directories.txt
\ No newline at end of file
+  rm -f "$file_list"
+
+done < new_directories.txt
@@ -9,6 +9,11 @@ to ensure a structured and organized storage environment.
 - Uses regex patterns to match various filename formats.
 - Dynamically creates folders for organized file management.
 - Handles special cases like 'cumulative_activity' files which are sorted by year.
+- Matches all patterns with one compiled alternation and moves files in a thread pool.
+- Appends every moved file (model, date, site, size, row count) to `result_catalog.csv`
+  at the storage root so readers do not need to walk the tree.
+- Adds the detections of moved result files to the result store; files whose store update
+  fails are kept in `result_store_pending.csv` and retried on the next run.
 - Provides clear console output for progress and error handling.
 
 ### Expected Folder Structure
@@ -22,6 +27,11 @@ to ensure a structured and organized storage environment.
 │
 ├── YYYY/
 │   ├── cumulative_activity/
+│
+├── result_catalog.csv
+├── result_store_pending.csv (result files still to be added to the result store)
+├── result_store/        (Parquet dataset of all detections, see result_store.py)
+├── activity_cubes/      (detection counts per period, model, site and label)
 
 ### Usage
 Run the script directly using:
@@ -29,8 +39,15 @@ Run the script directly using:
 """
 
 import os
+import csv
 import shutil
 import re
+from concurrent.futures import ThreadPoolExecutor
+
+import result_store
+import result_schemas
+from result_schemas import count_rows
+from result_store import RESULT_CATALOG_NAME, RESULT_CATALOG_COLUMNS
 
 # Path to Manila storage where files are located
 MANILA_STORAGE_PATH = "/ecoacoustic-storage"
@@ -48,10 +65,97 @@ FILE_PATTERNS = {
 }
 
 
+# Single alternation of all patterns; each alternative is wrapped in its own group so the matched
+# alternative can be found from `match.lastindex` (the outer group closes last)
+PATTERN_GROUPS = {}
+_alternatives = []
+_group_index = 1
+for _pattern, _subfolder in FILE_PATTERNS.items():
+    PATTERN_GROUPS[_group_index] = _subfolder
+    _alternatives.append(f"({_pattern})")
+    _group_index += re.compile(_pattern).groups + 1
+COMBINED_PATTERN = re.compile("|".join(_alternatives))
+
+# Number of files moved at once
+NUM_MOVE_THREADS = 8
+
+
+def match_file(file):
+    """
+    Matches a filename against all FILE_PATTERNS at once.
+
+    Returns the subfolder (model) and date directory of the file, or None if no pattern matches.
+    """
+    match = COMBINED_PATTERN.match(file)
+    if not match:
+        return None
+
+    subfolder = PATTERN_GROUPS[match.lastindex]
+
+    # Special Case: Handle 'cumulative_activity' files
+    if 'cumulative_activity' in subfolder:
+        file_date = match.group(match.lastindex).split('__')[1][:4]  # Extract the year
+    else:
+        file_date = match.group(match.lastindex + 1)  # Standard date extraction (YYYYMMDD)
+
+    return subfolder, file_date
+
+
+def get_site(target_path, file):
+    """
+    Returns the site of a result file when it can be told from the file, otherwise an empty string.
+    """
+    if file.endswith('.csv'):
+        with open(target_path, newline='') as f:
+            reader = csv.DictReader(f)
+            if reader.fieldnames and 'Site name' in reader.fieldnames:
+                first_row = next(reader, None)
+                if first_row is not None:
+                    return first_row['Site name']
+    return ""
+
+
+def move_file(source_path, target_path, subfolder, file_date, file):
+    """
+    Moves one file into its target folder and returns its catalog entry.
+    """
+    try:
+        # Same filesystem: a rename is enough
+        os.replace(source_path, target_path)
+    except OSError:
+        shutil.move(source_path, target_path)
+
+    file_stat = os.stat(target_path)
+    row_count = "" if file.endswith('.png') else count_rows(target_path)
+    return {
+        "path": os.path.relpath(target_path, MANILA_STORAGE_PATH),
+        "model": subfolder,
+        "date": file_date,
+        "site": get_site(target_path, file),
+        "size": file_stat.st_size,
+        "row_count": row_count,
+        "mtime": file_stat.st_mtime,
+    }
+
+
+def append_to_catalog(entries):
+    """
+    Appends the catalog entries of moved files to the result catalog in one write.
+    """
+    catalog_path = os.path.join(MANILA_STORAGE_PATH, RESULT_CATALOG_NAME)
+    write_header = not os.path.exists(catalog_path)
+    with open(catalog_path, 'a', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=RESULT_CATALOG_COLUMNS)
+        if write_header:
+            writer.writeheader()
+        writer.writerows(entries)
+
+
 def organize_files():
     """
     Organizes files in the Manila storage path by identifying patterns in filenames
     and moving them into structured subdirectories based on their date and type.
+    Every moved file is added to the result catalog.
     """
 
     # Check if the Manila storage path exists
@@ -59,45 +163,56 @@ def organize_files():
         print(f"Error: Directory '{MANILA_STORAGE_PATH}' does not exist.")
         return
 
-    # List all files in the Manila storage directory
-    files = os.listdir(MANILA_STORAGE_PATH)
-    print("Files to organize:", files)
-
-    # Iterate through each file in the directory
-    for file in files:
-        print(f"Checking file: {file}")
-        
-        # Check each file against the defined patterns
-        for pattern, subfolder in FILE_PATTERNS.items():
-            match = re.match(pattern, file)
-            if match:
-                print(f"Matched pattern '{pattern}' for file '{file}'")
-
-                # Special Case: Handle 'cumulative_activity' files
-                if 'cumulative_activity' in subfolder:
-                    file_date = match.group(0).split('__')[1][:4]  # Extract the year
-                else:
-                    file_date = match.group(1)  # Standard date extraction (YYYYMMDD)
-
-                # Define the destination folder structure
-                date_directory = os.path.join(MANILA_STORAGE_PATH, file_date)
-                target_directory = os.path.join(date_directory, subfolder)
-
-                # Create the target folder if it doesn't exist
-                os.makedirs(target_directory, exist_ok=True)
-
-                # Define source and destination file paths
-                source_path = os.path.join(MANILA_STORAGE_PATH, file)
-                target_path = os.path.join(target_directory, file)
-
-                # Move the file to the appropriate folder
-                shutil.move(source_path, target_path)
-                print(f"Moved {file} → {target_directory}")
-                break  # Move to the next file once a match is found
-
+    # Match all files in the Manila storage directory in one pass
+    moves = []
+    target_directories = set()
+    with os.scandir(MANILA_STORAGE_PATH) as entries:
+        for entry in entries:
+            if not entry.is_file():
+                continue
+            matched = match_file(entry.name)
+            if matched is None:
+                continue
+            subfolder, file_date = matched
+
+            # Define the destination folder structure
+            target_directory = os.path.join(MANILA_STORAGE_PATH, file_date, subfolder)
+            target_directories.add(target_directory)
+            moves.append((entry.path, os.path.join(target_directory, entry.name), subfolder, file_date, entry.name))
+
+    print(f"Files to organize: {len(moves)}")
+
+    # Create the target folders if they don't exist
+    for target_directory in target_directories:
+        os.makedirs(target_directory, exist_ok=True)
+
+    # Move the files to the appropriate folders
+    catalog_entries = []
+    with ThreadPoolExecutor(max_workers=NUM_MOVE_THREADS) as executor:
+        futures = [executor.submit(move_file, *move) for move in moves]
+        for (source_path, target_path, _, _, _), future in zip(moves, futures):
+            try:
+                catalog_entries.append(future.result())
+            except OSError as e:
+                print(f"Error moving {source_path} → {target_path}: {e}")
+
+    if catalog_entries:
+        append_to_catalog(catalog_entries)
+
+        # Add the detections of the moved result files to the Parquet result store
+        result_files = []
+        for entry in catalog_entries:
+            model = result_schemas.get_result_model(os.path.basename(entry["path"]))
+            if model is not None:
+                result_files.append((os.path.join(MANILA_STORAGE_PATH, entry["path"]), model))
+        result_store.add_result_files(result_files,
+                                      os.path.join(MANILA_STORAGE_PATH, "result_store"),
+                                      os.path.join(MANILA_STORAGE_PATH, "activity_cubes"),
+                                      os.path.join(MANILA_STORAGE_PATH, result_store.PENDING_FILES_NAME))
+
+    print(f"Moved {len(catalog_entries)} files into {len(target_directories)} folders.")
     print("File organization complete.")
 
 
 if __name__ == "__main__":
     organize_files()
-
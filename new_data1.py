@@ -1,6 +1,10 @@
 import os
 import sys
 import json
+import hashlib
+import sqlite3
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
 
 '''
 Implementation:
@@ -10,8 +14,15 @@ the ubna01 folder. These file paths are the files that have already been "seen"
 of the data. For each SD card, this script compares the files in the metadata with those 
 currently existing in the OSN bucket which have been mounted to /tmp/osn_bucket/<SD card #>.
 If there are files in the OSN_bucket that are not present in the metadata file, we know new data has been added to 
-the bucket. The absolute path of the directory containing the new data is written to new_directories.txt.
-Each directory in new_directories.txt is later used as input for the models.
+the bucket. Each SD card is listed with a single recursive `rclone lsjson` call against the bucket instead of walking 
+the FUSE mount directory by directory. The metadata files are mirrored in a SQLite manifest (osn_bucket_manifest.db) 
+that also stores the size of each file and a signature of every directory listing, so only directories whose listing 
+changed since the last run are compared, and the five SD card directories are listed concurrently.
+The absolute path of the directory containing the new data is written to new_directories.txt.
+Each directory in new_directories.txt is later used as input for the models, which only process the files of that 
+directory listed in new_files.txt.
+New files whose content matches a file that was already seen (e.g. .Trash-* copies) are left out of new_files.txt 
+and listed with the file they duplicate in duplicate_files.csv.
 The newly detected files are updated in the metadata files as they have now been seen and 
 no longer new. If no new data is detected, the model errors out sys.exit(1).
 '''
@@ -19,6 +30,16 @@ no longer new. If no new data is detected, the model errors out sys.exit(1).
 # Define the directory containing the filelist files and rclone mount directory
 metadata_dir = './osn_bucket_metadata/'
 rclone_mount_dir = '/tmp/osn_bucket/'  # The directory where your rclone mount is located
+rclone_remote = 'osn_sdsc_ubna:bio230143-bucket01/'  # The remote the SD card directories are mounted from
+manifest_path = os.path.join(metadata_dir, 'osn_bucket_manifest.db')
+
+# Version of the manifest tables; open_manifest migrates manifests written by older versions
+manifest_version = 2
+
+# Duplicate recordings are found by hashing the first and last MB of files with the same name and size;
+# set verify_duplicates_with_full_hash to hash whole files instead
+fingerprint_block_size = 1024 * 1024
+verify_duplicates_with_full_hash = False
 
 # Directories and corresponding filelist files
 directories = ['ubna_data_01', 'ubna_data_02', 'ubna_data_03', 'ubna_data_04', 'ubna_data_05']
@@ -40,34 +61,155 @@ def read_filelist(file_list_path):
         return set(f.read().splitlines())
 
 
+def open_manifest(manifest_path):
+    '''
+    Parameters
+    ------------
+    manifest_path : str
+        - The path to the SQLite manifest of seen files
+
+    Returns
+    ------------
+    connection to the manifest, with its tables created if they did not exist and migrated to manifest_version
+    '''
+    conn = sqlite3.connect(manifest_path)
+    conn.executescript('''
+        CREATE TABLE IF NOT EXISTS files (
+            bucket TEXT,
+            directory TEXT,
+            path TEXT,
+            name TEXT,
+            size INTEGER,
+            mtime REAL,
+            PRIMARY KEY (bucket, path)
+        );
+        CREATE TABLE IF NOT EXISTS fingerprints (
+            bucket TEXT,
+            path TEXT,
+            fingerprint TEXT,
+            PRIMARY KEY (bucket, path)
+        );
+        CREATE TABLE IF NOT EXISTS duplicates (
+            bucket TEXT,
+            path TEXT,
+            original_bucket TEXT,
+            original_path TEXT,
+            PRIMARY KEY (bucket, path)
+        );
+        CREATE TABLE IF NOT EXISTS directories (
+            bucket TEXT,
+            path TEXT,
+            signature TEXT,
+            PRIMARY KEY (bucket, path)
+        );
+        CREATE TABLE IF NOT EXISTS filelists (
+            name TEXT PRIMARY KEY,
+            size INTEGER,
+            mtime REAL
+        );
+    ''')
+    migrate_manifest(conn)
+    conn.executescript('''
+        CREATE INDEX IF NOT EXISTS idx_files_directory ON files (bucket, directory);
+        CREATE INDEX IF NOT EXISTS idx_files_name_size ON files (name, size);
+    ''')
+    return conn
+
+
+def migrate_manifest(conn):
+    '''
+    Adds the columns that were introduced after a manifest was created, tracked through PRAGMA user_version:
+    version 2 added the name of each file.
+
+    Parameters
+    ------------
+    conn : sqlite3.Connection
+        - The connection to the manifest
+    '''
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version >= manifest_version:
+        return
+
+    with conn:
+        file_columns = {row[1] for row in conn.execute("PRAGMA table_info(files)")}
+        if 'name' not in file_columns:
+            conn.execute("ALTER TABLE files ADD COLUMN name TEXT")
+        conn.executemany(
+            "UPDATE files SET name = ? WHERE bucket = ? AND path = ?",
+            [(os.path.basename(path), bucket, path) for bucket, path in conn.execute("SELECT bucket, path FROM files WHERE name IS NULL")],
+        )
+
+
+        conn.execute(f"PRAGMA user_version = {manifest_version}")
+
+
+def sync_filelist(conn, dir_name, file_list_path):
+    '''
+    Adds the files of a metadata file to the manifest if the metadata file changed since it was last read,
+    e.g. after it was updated through git.
+
+    Parameters
+    ------------
+    conn : sqlite3.Connection
+        - The connection to the manifest
+    dir_name : str
+        - The SD card directory the metadata file belongs to
+    file_list_path : str
+        - The path to the metadata file containing existing files in OSN bucket
+    '''
+    file_list_stat = os.stat(file_list_path)
+    row = conn.execute("SELECT size, mtime FROM filelists WHERE name = ?", (file_list_path,)).fetchone()
+    if row == (file_list_stat.st_size, file_list_stat.st_mtime):
+        return
+
+    existing_files = read_filelist(file_list_path)
+    with conn:
+        conn.executemany(
+            "INSERT OR IGNORE INTO files (bucket, directory, path, name) VALUES (?, ?, ?, ?)",
+            ((dir_name, os.path.dirname(file), file, os.path.basename(file)) for file in existing_files if file),
+        )
+        conn.execute("INSERT OR REPLACE INTO filelists (name, size, mtime) VALUES (?, ?, ?)",
+                     (file_list_path, file_list_stat.st_size, file_list_stat.st_mtime))
+
+
 def get_files_from_rclone(directory):
     '''
     Parameters
     ------------
     directory : str
-        - The SD card directory to get a set of the current files in the OSN bucket
+        - The SD card directory to list in the OSN bucket
 
     Returns
     ------------
-    set of current files in OSN Bucket
+    dict mapping each directory (relative to the SD card directory) to the signature of its listing
+    and the size of the .WAV files directly inside it
     '''
-    current_files = set()
-    
-    directory_path = os.path.join(rclone_mount_dir, directory)
-    dir_path = directory_path + '/'
-    
-    for root, _, files in os.walk(dir_path):
-        for file in files:
-            full_path = os.path.join(root, file)
-            cleaned_path = full_path.replace(dir_path, '')  # Clean path to make it relative to the mounted directory
-            current_files.add(cleaned_path)
-    
-    return current_files
+    # One recursive listing of the bucket; --no-modtime avoids reading the metadata of every object
+    listing_json = subprocess.run(
+        ["rclone", "lsjson", "--recursive", "--files-only", "--fast-list", "--no-modtime", "--no-mimetype",
+         rclone_remote + directory],
+        check=True, capture_output=True, text=True,
+    ).stdout
+
+    listings = {}
+    wav_files = {}
+    for entry in json.loads(listing_json):
+        relative_dir = os.path.dirname(entry["Path"])
+        listings.setdefault(relative_dir, []).append(f"{entry['Name']}\0{entry['Size']}")
+        if entry["Name"].endswith(".WAV") or entry["Name"].endswith(".wav"):
+            wav_files.setdefault(relative_dir, {})[entry["Path"]] = entry["Size"]
+
+    return {
+        relative_dir: (hashlib.sha1("\n".join(sorted(listing)).encode()).hexdigest(), wav_files.get(relative_dir, {}))
+        for relative_dir, listing in listings.items()
+    }
 
 # Function to check for new files in each directory
 def check_for_new_files():
     '''
     Function to check for files that exist in OSN bucket but not in list of seen files. 
+    The five SD card directories are listed concurrently, only directories whose listing changed since
+    the last run are compared with the manifest, and all new files are recorded in one batch.
     Parameters
     ------------
     None
@@ -77,37 +219,181 @@ def check_for_new_files():
     list of new files
     '''
     new_files = []
+    conn = open_manifest(manifest_path)
 
-    # Iterate over each directory and corresponding filelist
     for dir_name, filelist_name in zip(directories, filelist_files):
         file_path = os.path.join(metadata_dir, filelist_name)
-        existing_files = read_filelist(file_path)
-        
-        # Get the current files in the corresponding directory from the rclone mount
-        current_files = get_files_from_rclone(dir_name)
+        sync_filelist(conn, dir_name, file_path)
 
-        # Find new files (i.e., files in current_files but not in existing_files)
-        new_files_in_current = list(current_files - existing_files)
+    # Get the current files in each directory from the rclone remote
+    with ThreadPoolExecutor(max_workers=len(directories)) as executor:
+        listings = list(executor.map(get_files_from_rclone, directories))
+
+    new_entries = {}
+    file_rows = []
+    directory_rows = []
+    for dir_name, filelist_name, current_directories in zip(directories, filelist_files, listings):
+        stored_signatures = dict(conn.execute("SELECT path, signature FROM directories WHERE bucket = ?", (dir_name,)))
+        new_files_in_current = []
+
+        for relative_dir, (signature, wav_files) in current_directories.items():
+            if stored_signatures.get(relative_dir) == signature:
+                continue
+
+            # Find new files (i.e., files in the changed directory listing but not in the manifest)
+            existing_files = {row[0] for row in conn.execute(
+                "SELECT path FROM files WHERE bucket = ? AND directory = ?", (dir_name, relative_dir))}
+            for file, size in wav_files.items():
+                if file not in existing_files:
+                    new_files_in_current.append(file)
+                file_rows.append((dir_name, relative_dir, file, os.path.basename(file), size))
+            directory_rows.append((dir_name, relative_dir, signature))
 
         if new_files_in_current:
-            for file in new_files_in_current:
-                if file.endswith(".WAV") or file.endswith(".wav"):
-                    # Full path including the base directory
-                    full_path = os.path.join(rclone_mount_dir, dir_name, file)
-                    new_files.append(full_path)
-
-                    # Write the new file to the filelist
-                    with open(file_path, "a") as f:
-                        if not file.endswith('\n'):
-                            f.write(f"{file}\n")
-                        else:
-                            f.write(file)
+            new_entries[filelist_name] = sorted(new_files_in_current)
+            # Full path including the base directory
+            new_files += [os.path.join(rclone_mount_dir, dir_name, file) for file in new_entries[filelist_name]]
+
+    # Write the new files to the filelists, replacing each one in a single step
+    for filelist_name, entries in new_entries.items():
+        file_path = os.path.join(metadata_dir, filelist_name)
+        tmp_path = f"{file_path}.tmp"
+        with open(file_path, "r") as f:
+            existing_content = f.read()
+        with open(tmp_path, "w") as f:
+            f.write(existing_content)
+            if existing_content and not existing_content.endswith("\n"):
+                f.write("\n")
+            f.writelines(f"{file}\n" for file in entries)
+        os.replace(tmp_path, file_path)
+
+    # Commit the manifest in one transaction
+    with conn:
+        conn.executemany("INSERT OR REPLACE INTO files (bucket, directory, path, name, size) VALUES (?, ?, ?, ?, ?)", file_rows)
+        conn.executemany("INSERT OR REPLACE INTO directories (bucket, path, signature) VALUES (?, ?, ?)", directory_rows)
+        for filelist_name in new_entries:
+            file_path = os.path.join(metadata_dir, filelist_name)
+            file_list_stat = os.stat(file_path)
+            conn.execute("INSERT OR REPLACE INTO filelists (name, size, mtime) VALUES (?, ?, ?)",
+                         (file_path, file_list_stat.st_size, file_list_stat.st_mtime))
+    conn.close()
     
     return new_files
 
+def get_fingerprint(full_path, size):
+    '''
+    Parameters
+    ------------
+    full_path : str
+        - The path to a file in the OSN bucket
+    size : int
+        - The size of the file in bytes
+
+    Returns
+    ------------
+    fingerprint of the file made from its size and a hash of its first and last MB,
+    or of its whole content if verify_duplicates_with_full_hash is set
+    '''
+    file_hash = hashlib.sha1(str(size).encode())
+    with open(full_path, "rb") as f:
+        if verify_duplicates_with_full_hash:
+            for block in iter(lambda: f.read(fingerprint_block_size), b""):
+                file_hash.update(block)
+        else:
+            file_hash.update(f.read(fingerprint_block_size))
+            if size > 2 * fingerprint_block_size:
+                f.seek(-fingerprint_block_size, os.SEEK_END)
+            file_hash.update(f.read(fingerprint_block_size))
+    return file_hash.hexdigest()
+
+
+def get_cached_fingerprint(conn, bucket, path, size):
+    '''
+    Returns the stored fingerprint of a file, computing and storing it first if needed.
+    Returns None if the file can no longer be read.
+    '''
+    row = conn.execute("SELECT fingerprint FROM fingerprints WHERE bucket = ? AND path = ?", (bucket, path)).fetchone()
+    if row is not None:
+        return row[0]
+
+    try:
+        fingerprint = get_fingerprint(os.path.join(rclone_mount_dir, bucket, path), size)
+    except OSError:
+        return None
+    conn.execute("INSERT OR REPLACE INTO fingerprints (bucket, path, fingerprint) VALUES (?, ?, ?)", (bucket, path, fingerprint))
+    return fingerprint
+
+
+def remove_duplicate_files(new_files):
+    '''
+    Function to skip new files whose content was already seen, e.g. the .Trash-* copies of recordings.
+    Only files with the same name and size as a new file are candidates, so files are only read when
+    a candidate exists. Files outside .Trash-* folders are kept over their copies inside them.
+    Parameters
+    ------------
+    new_files : list
+        - The full paths of the new files found by check_for_new_files
+
+    Returns
+    ------------
+    list of new files that are not duplicates, and list of (duplicate, original) full path pairs
+    '''
+    conn = open_manifest(manifest_path)
+    pending = set()
+    for full_path in new_files:
+        bucket, path = os.path.relpath(full_path, rclone_mount_dir).split(os.sep, 1)
+        pending.add((bucket, path))
+
+    unique_files = []
+    duplicate_files = []
+    for full_path in sorted(new_files, key=lambda file: ('.Trash' in file, file)):
+        bucket, path = os.path.relpath(full_path, rclone_mount_dir).split(os.sep, 1)
+        pending.discard((bucket, path))
+        size = conn.execute("SELECT size FROM files WHERE bucket = ? AND path = ?", (bucket, path)).fetchone()[0]
+        if not size:
+            unique_files.append(full_path)
+            continue
+
+        candidates = [
+            (candidate_bucket, candidate_path) for candidate_bucket, candidate_path in conn.execute(
+                """SELECT bucket, path FROM files WHERE name = ? AND size = ? AND NOT (bucket = ? AND path = ?)
+                AND NOT EXISTS (SELECT 1 FROM duplicates WHERE duplicates.bucket = files.bucket AND duplicates.path = files.path)""",
+                (os.path.basename(path), size, bucket, path))
+            if (candidate_bucket, candidate_path) not in pending
+        ]
+
+        original = None
+        if candidates:
+            fingerprint = get_cached_fingerprint(conn, bucket, path, size)
+            for candidate_bucket, candidate_path in candidates:
+                if fingerprint is not None and get_cached_fingerprint(conn, candidate_bucket, candidate_path, size) == fingerprint:
+                    original = (candidate_bucket, candidate_path)
+                    break
+
+        if original is None:
+            unique_files.append(full_path)
+        else:
+            conn.execute("INSERT OR REPLACE INTO duplicates (bucket, path, original_bucket, original_path) VALUES (?, ?, ?, ?)",
+                         (bucket, path, original[0], original[1]))
+            duplicate_files.append((full_path, os.path.join(rclone_mount_dir, original[0], original[1])))
+
+    conn.commit()
+    conn.close()
+
+    return unique_files, duplicate_files
+
 # Run the check
 if __name__ == "__main__":
     new_files = check_for_new_files()
+    new_files, duplicate_files = remove_duplicate_files(new_files)
+
+    # Write the duplicates with the file whose results they share to duplicate_files.csv
+    if duplicate_files:
+        print(f"Skipping {len(duplicate_files)} duplicate files.")
+        with open("duplicate_files.csv", "w") as f:
+            f.write("duplicate_file,original_file\n")
+            for duplicate_file, original_file in duplicate_files:
+                f.write(f"{duplicate_file},{original_file}\n")
 
     # If new files are found, return success (exit code 0) and print the new files as JSON
     if new_files:
@@ -122,6 +408,15 @@ if __name__ == "__main__":
         with open("new_directories.txt", "w") as f:
             for directory in full_directories:
                 f.write(f"{directory}\n")
+
+        # Write the exact new files to new_files.txt so the model runners only process new recordings
+        with open("new_files.txt", "w") as f:
+            for file in sorted(new_files):
+                f.write(f"{file}\n")
+
+        # Remove the usable files of the previous run; validate_new_files.py writes them for this run
+        if os.path.exists("usable_files.txt"):
+            os.remove("usable_files.txt")
         
         sys.exit(0)  # Success
 
@@ -0,0 +1,146 @@
+"""
+Result Schemas
+
+Declares, for every model, which result files hold its detections, how their columns map to
+the normalized columns of the result store, and the dtype of each normalized column. Result
+files are read with only the columns a view needs, with explicit dtypes and the pyarrow CSV
+engine, instead of reading every column and renaming by substring.
+
+### Adding a Model
+Add an entry to RESULT_SCHEMAS with:
+- pattern: regular expression matching the names of its result files
+- columns: lowercase column of its result file → normalized column
+- dtypes: normalized column → pandas dtype
+
+### Views
+VIEW_COLUMNS lists the normalized columns each consumer reads:
+- store: everything result_store.py writes to the Parquet dataset
+- activity: what the dashboard needs for the activity heatmap and statistics
+"""
+
+import os
+import re
+import csv
+
+import pandas as pd
+
+RESULT_SCHEMAS = {
+    'batdetect2': {
+        'pattern': r"batdetect2_pipeline_\d{8}_\d{6}\.csv",
+        'columns': {
+            'start_time': 'start', 'end_time': 'end', 'low_freq': 'low_freq', 'high_freq': 'high_freq',
+            'class': 'label', 'class_prob': 'confidence', 'kmeans_classes': 'freq_group', 'site name': 'site',
+        },
+        'dtypes': {
+            'start': 'float64', 'end': 'float64', 'low_freq': 'float64', 'high_freq': 'float64',
+            'label': 'category', 'confidence': 'float64', 'freq_group': 'category', 'site': 'category',
+        },
+    },
+    'buzzfindr': {
+        'pattern': r"Buzz_Results_\d{8}_\d{6}\.csv",
+        'columns': {
+            'start': 'start', 'start_time': 'start', 'end': 'end', 'end_time': 'end',
+            'buzz': 'label', 'buzzprob': 'confidence',
+        },
+        'dtypes': {'start': 'float64', 'end': 'float64', 'label': 'category', 'confidence': 'float64'},
+    },
+    'frognet': {
+        'pattern': r"frognet_\d{8}_\d{6}_species\.csv",
+        'columns': {'start time': 'start', 'end time': 'end', 'scientific name': 'label', 'confidence': 'confidence'},
+        'dtypes': {'start': 'float64', 'end': 'float64', 'label': 'category', 'confidence': 'float64'},
+    },
+    'birdnet': {
+        'pattern': r"birdnet\d{8}_\d{6}_species\.csv",
+        'columns': {'start time': 'start', 'end time': 'end', 'scientific name': 'label', 'confidence': 'confidence'},
+        'dtypes': {'start': 'float64', 'end': 'float64', 'label': 'category', 'confidence': 'float64'},
+    },
+    'battybirdnet': {
+        'pattern': r"\d{8}_\d{6}\.bat\.results_USA\.csv",
+        'columns': {'start (s)': 'start', 'end (s)': 'end', 'scientific name': 'label', 'confidence': 'confidence'},
+        'dtypes': {'start': 'float64', 'end': 'float64', 'label': 'category', 'confidence': 'float64'},
+    },
+}
+
+VIEW_COLUMNS = {
+    'store': ['site', 'start', 'end', 'low_freq', 'high_freq', 'label', 'confidence', 'freq_group'],
+    'activity': ['start', 'label', 'confidence', 'freq_group'],
+}
+
+
+def get_result_model(file):
+    """
+    Returns the model that wrote a result file, or None if the file does not hold detections.
+    """
+    for model, schema in RESULT_SCHEMAS.items():
+        if re.match(schema['pattern'], file):
+            return model
+    return None
+
+
+def count_rows(target_path):
+    """
+    Returns the number of rows below the header of a .csv or .txt result file.
+    """
+    with open(target_path, 'rb') as f:
+        num_lines = sum(block.count(b'\n') for block in iter(lambda: f.read(1024 * 1024), b''))
+        if f.tell() > 0:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b'\n':
+                num_lines += 1
+    return max(num_lines - 1, 0)
+
+
+def _read_header(file_path):
+    with open(file_path, newline='', encoding='utf-8', errors='replace') as f:
+        return next(csv.reader(f), [])
+
+
+def _select_columns(header, model, view):
+    """
+    Maps the header of a result file to the normalized columns of a view.
+    The first file column mapping to a normalized column is used.
+    """
+    column_map = RESULT_SCHEMAS[model]['columns']
+    selected = {}
+    for column in header:
+        normalized = column_map.get(column.strip().lower())
+        if normalized in VIEW_COLUMNS[view] and normalized not in selected.values():
+            selected[column] = normalized
+    return selected
+
+
+def read_result_csv(file_path, model, view='store'):
+    """
+    Reads the columns of a result file that a view needs, typed as declared in RESULT_SCHEMAS.
+
+    Parameters
+    ------------
+    file_path : str
+        - The path to the result file
+    model : str
+        - The model that wrote the file (a key of RESULT_SCHEMAS)
+    view : str
+        - A key of VIEW_COLUMNS
+
+    Returns
+    ------------
+    pandas.DataFrame with the normalized column names of the view that the file has
+    """
+    dtypes = RESULT_SCHEMAS[model]['dtypes']
+    selected = _select_columns(_read_header(file_path), model, view)
+    if not selected:
+        return pd.DataFrame()
+
+    read_dtypes = {column: dtypes.get(normalized, 'string') for column, normalized in selected.items()}
+    try:
+        df = pd.read_csv(file_path, usecols=list(selected), dtype=read_dtypes, engine='pyarrow')
+    except (ValueError, TypeError):
+        # A value that does not parse as its declared type (e.g. "NA" text in a number column)
+        df = pd.read_csv(file_path, usecols=list(selected), dtype=str)
+        for column, normalized in selected.items():
+            if dtypes.get(normalized) == 'float64':
+                df[column] = pd.to_numeric(df[column], errors='coerce')
+            elif dtypes.get(normalized) == 'category':
+                df[column] = df[column].astype('category')
+
+    return df.rename(columns=selected)
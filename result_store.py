@@ -0,0 +1,493 @@
+"""
+Result Store for Manila Storage
+
+Normalizes the detections of all five models into one Parquet dataset so the dashboard can
+query them with `pyarrow.dataset` filters instead of reading and renaming every result CSV.
+
+### Normalized Schema
+| column      | meaning                                                    |
+|-------------|------------------------------------------------------------|
+| model       | batdetect2, buzzfindr, frognet, birdnet or battybirdnet    |
+| site        | recording site, if the result file records it              |
+| file        | name of the result file the detection came from            |
+| start_utc   | absolute start of the detection (UTC)                      |
+| end_utc     | absolute end of the detection (UTC)                        |
+| low_freq    | lowest frequency of the detection in Hz, if known          |
+| high_freq   | highest frequency of the detection in Hz, if known         |
+| label       | species (scientific name), bat class or buzz label         |
+| confidence  | model confidence of the label                              |
+| freq_group  | batdetect2 LF/HF KMeans class, if known                    |
+
+### Expected Folder Structure
+/ecoacoustic-storage/result_store/
+├── date=YYYYMMDD/
+│   ├── model=batdetect2/
+│   │   ├── part-0.parquet
+│   │   ├── _source_files.txt
+
+Each date and model partition is kept as one Parquet file. Adding a result file replaces its
+earlier detections, so moving or re-running a file never stores it twice. _source_files.txt
+lists the result files that have been added, including those without detections, so the
+dashboard can tell a date that is fully in the store from one that is only partly added.
+
+### Activity Cubes
+Detection counts are also materialized per model, site, label and freq_group at several
+resolutions (1min, 10min, 1h, 1d and 1M) so the dashboard never aggregates raw detections.
+The 1min cube is kept for the share of the day with detections. Cubes of a date are rebuilt
+when detections of that date are added, and the month cube from the day cubes of the month.
+
+/ecoacoustic-storage/activity_cubes/
+├── resolution=10min/
+│   ├── model=batdetect2/
+│   │   ├── period=YYYYMMDD/cube.parquet
+├── resolution=1M/
+│   ├── model=batdetect2/
+│   │   ├── period=YYYYMM/cube.parquet
+
+### Usage
+Files are added by move_manila_files.py as they are organized. If adding them fails, they are
+listed in result_store_pending.csv and added by the next run. To rebuild the store from the
+result catalog, run:
+    python3 result_store.py
+"""
+
+import os
+import re
+import csv
+import uuid
+import shutil
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from result_schemas import get_result_model, read_result_csv
+
+# Path to Manila storage and the Parquet dataset inside it
+MANILA_STORAGE_PATH = "/ecoacoustic-storage"
+RESULT_STORE_PATH = os.path.join(MANILA_STORAGE_PATH, "result_store")
+ACTIVITY_CUBES_PATH = os.path.join(MANILA_STORAGE_PATH, "activity_cubes")
+
+# Append-only catalog of every organized result file, written by move_manila_files.py, so readers
+# do not need to walk the storage tree
+RESULT_CATALOG_NAME = "result_catalog.csv"
+RESULT_CATALOG_COLUMNS = ["path", "model", "date", "site", "size", "row_count", "mtime"]
+
+# Result files whose store update failed, retried by the next add_result_files()
+PENDING_FILES_NAME = "result_store_pending.csv"
+PENDING_FILES_PATH = os.path.join(MANILA_STORAGE_PATH, PENDING_FILES_NAME)
+
+RESULT_SCHEMA = pa.schema([
+    ('model', pa.string()),
+    ('site', pa.string()),
+    ('file', pa.string()),
+    ('start_utc', pa.timestamp('ms')),
+    ('end_utc', pa.timestamp('ms')),
+    ('low_freq', pa.float64()),
+    ('high_freq', pa.float64()),
+    ('label', pa.string()),
+    ('confidence', pa.float64()),
+    ('freq_group', pa.string()),
+    ('date', pa.string()),
+])
+
+# Columns of the Parquet files; date and model are encoded in the partition directories
+PARTITION_FILE_SCHEMA = pa.schema([field for field in RESULT_SCHEMA if field.name not in ('date', 'model')])
+PARTITION_FILE_NAME = "part-0.parquet"
+SOURCE_FILES_NAME = "_source_files.txt"
+
+PARTITIONING = ds.partitioning(pa.schema([('date', pa.string()), ('model', pa.string())]), flavor="hive")
+
+FILE_DATETIME_PATTERN = re.compile(r"(\d{8})_(\d{6})")
+
+# Resolutions of the activity cubes built from the detections of one date → pandas frequency
+DAILY_RESOLUTIONS = {
+    '1min': '1min',
+    '10min': '10min',
+    '1h': '1h',
+    '1d': '1D',
+}
+MONTHLY_RESOLUTION = '1M'
+
+CUBE_DIMENSIONS = ['period_start', 'model', 'site', 'label', 'freq_group']
+
+CUBE_SCHEMA = pa.schema([
+    ('period_start', pa.timestamp('ms')),
+    ('site', pa.string()),
+    ('label', pa.string()),
+    ('freq_group', pa.string()),
+    ('detection_count', pa.int64()),
+    ('confidence_sum', pa.float64()),
+    ('confidence_count', pa.int64()),
+])
+
+CUBE_PARTITIONING = ds.partitioning(
+    pa.schema([('resolution', pa.string()), ('model', pa.string()), ('period', pa.string())]), flavor="hive")
+
+
+def normalize_result_file(file_path, model, view='store'):
+    """
+    Reads one result file and converts it to the normalized schema.
+
+    Parameters
+    ------------
+    file_path : str
+        - The path to the result file
+    model : str
+        - The model that wrote the file (a key of result_schemas.RESULT_SCHEMAS)
+    view : str
+        - The result_schemas view to read; columns outside it are left empty
+
+    Returns
+    ------------
+    pandas.DataFrame in the normalized schema (empty if the file has no detections)
+    """
+    file = os.path.basename(file_path)
+    file_date, file_time = FILE_DATETIME_PATTERN.search(file).groups()
+    file_datetime = pd.Timestamp(f"{file_date} {file_time}")
+
+    try:
+        df = read_result_csv(file_path, model, view)
+    except pd.errors.EmptyDataError:
+        df = pd.DataFrame()
+
+    normalized = pd.DataFrame(index=df.index)
+    normalized['model'] = model
+    normalized['site'] = df['site'].astype(str) if 'site' in df.columns else ""
+    normalized['file'] = file
+    for column in ['start', 'end']:
+        offsets = df[column] if column in df.columns else np.nan
+        normalized[f'{column}_utc'] = file_datetime + pd.to_timedelta(offsets, unit='s')
+    for column in ['low_freq', 'high_freq', 'confidence']:
+        normalized[column] = df[column] if column in df.columns else np.nan
+    for column in ['label', 'freq_group']:
+        normalized[column] = df[column].astype(str).where(df[column].notna(), None) if column in df.columns else None
+    normalized['date'] = file_date
+
+    return normalized
+
+
+def _partition_dir(store_path, date, model):
+    return os.path.join(store_path, f"date={date}", f"model={model}")
+
+
+def stored_files(date, model, store_path=RESULT_STORE_PATH):
+    """
+    Returns the names of the result files whose detections of a date and model have been added to the store.
+    """
+    source_files_path = os.path.join(_partition_dir(store_path, date, model), SOURCE_FILES_NAME)
+    if not os.path.exists(source_files_path):
+        return set()
+    with open(source_files_path) as f:
+        return {line.strip() for line in f if line.strip()}
+
+
+def _replace_partition(store_path, date, model, detections_df, files):
+    """
+    Replaces the detections of the given result files in one date and model partition,
+    keeping the detections of all other files, and records the files as added.
+    """
+    partition_dir = _partition_dir(store_path, date, model)
+    os.makedirs(partition_dir, exist_ok=True)
+
+    # Part files written before partitions were kept as one file are merged into it
+    part_paths = sorted(os.path.join(partition_dir, name) for name in os.listdir(partition_dir)
+                        if name.endswith('.parquet') and not name.startswith(('.', '_')))
+    tables = []
+    if part_paths:
+        dataset = ds.dataset(part_paths, format="parquet", schema=PARTITION_FILE_SCHEMA)
+        tables.append(dataset.to_table(filter=~ds.field('file').isin(list(files))))
+    tables.append(pa.Table.from_pandas(detections_df[PARTITION_FILE_SCHEMA.names], schema=PARTITION_FILE_SCHEMA,
+                                       preserve_index=False))
+
+    tmp_path = os.path.join(partition_dir, f".part-{uuid.uuid4().hex}.parquet")
+    pq.write_table(pa.concat_tables(tables), tmp_path)
+    os.replace(tmp_path, os.path.join(partition_dir, PARTITION_FILE_NAME))
+    for part_path in part_paths:
+        if os.path.basename(part_path) != PARTITION_FILE_NAME:
+            os.remove(part_path)
+
+    tmp_path = os.path.join(partition_dir, f".source-files-{uuid.uuid4().hex}.txt")
+    with open(tmp_path, 'w') as f:
+        f.writelines(f"{file}\n" for file in sorted(stored_files(date, model, store_path) | set(files)))
+    os.replace(tmp_path, os.path.join(partition_dir, SOURCE_FILES_NAME))
+
+
+def append_results(result_files, store_path=RESULT_STORE_PATH, cubes_path=ACTIVITY_CUBES_PATH):
+    """
+    Adds the detections of result files to the store, replacing the detections stored earlier
+    for the same files, and rebuilds the activity cubes of the dates and models they belong to.
+
+    Parameters
+    ------------
+    result_files : list
+        - (file_path, model) pairs of the result files to add
+    store_path : str
+        - The root of the Parquet dataset
+    cubes_path : str
+        - The root of the activity cubes, or None to leave the cubes alone
+
+    Returns
+    ------------
+    number of detections added
+    """
+    frames = []
+    partition_files = {}
+    for file_path, model in result_files:
+        file = os.path.basename(file_path)
+        try:
+            frames.append(normalize_result_file(file_path, model))
+        except (OSError, ValueError, pd.errors.ParserError) as e:
+            print(f"Error adding {file_path} to the result store: {e}")
+            continue
+        date = FILE_DATETIME_PATTERN.search(file).group(1)
+        partition_files.setdefault((date, model), set()).add(file)
+
+    if not partition_files:
+        return 0
+
+    detections_df = pd.concat(frames, ignore_index=True)
+    num_rows = 0
+    for (date, model), files in partition_files.items():
+        partition_df = detections_df[(detections_df['date'] == date) & (detections_df['model'] == model)]
+        _replace_partition(store_path, date, model, partition_df, files)
+        num_rows += len(partition_df)
+
+    if cubes_path is not None:
+        update_activity_cubes(list(partition_files), store_path, cubes_path)
+
+    return num_rows
+
+
+def add_result_files(result_files, store_path=RESULT_STORE_PATH, cubes_path=ACTIVITY_CUBES_PATH,
+                     pending_path=PENDING_FILES_PATH):
+    """
+    Adds result files to the store together with the files an earlier failed call left pending.
+    If the store update fails, all of them are written to the pending list so the next call retries
+    them, instead of leaving the store behind until it is rebuilt by hand.
+
+    Parameters
+    ------------
+    result_files : list
+        - (file_path, model) pairs of the result files to add
+    store_path : str
+        - The root of the Parquet dataset
+    cubes_path : str
+        - The root of the activity cubes, or None to leave the cubes alone
+    pending_path : str
+        - The .csv list of result files still to be added
+
+    Returns
+    ------------
+    number of detections added, or None if the store update failed
+    """
+    pending_files = []
+    if os.path.exists(pending_path):
+        with open(pending_path, newline='') as f:
+            pending_files = [(entry['path'], entry['model']) for entry in csv.DictReader(f)]
+
+    # Pending files that were removed or moved since cannot be added any more
+    result_files = list(dict.fromkeys(
+        [(file_path, model) for file_path, model in pending_files if os.path.exists(file_path)] + list(result_files)))
+    if not result_files:
+        return 0
+
+    try:
+        num_rows = append_results(result_files, store_path, cubes_path)
+    except Exception as e:
+        tmp_path = f"{pending_path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['path', 'model'])
+            writer.writerows(result_files)
+        os.replace(tmp_path, pending_path)
+        print(f"Error updating the result store, {len(result_files)} result files are pending: {e}")
+        return None
+
+    if os.path.exists(pending_path):
+        os.remove(pending_path)
+    print(f"Added {num_rows} detections from {len(result_files)} result files to the result store.")
+    return num_rows
+
+
+def query_results(store_path=RESULT_STORE_PATH, date=None, model=None, site=None, columns=None, labels=None):
+    """
+    Reads detections from the store, only opening the partitions that match the filters.
+
+    Parameters
+    ------------
+    store_path : str
+        - The root of the Parquet dataset
+    date : str
+        - YYYYMMDD date to select, or None for all dates
+    model : str
+        - Model to select, or None for all models
+    site : str
+        - Site to select, or None for all sites
+    columns : list
+        - Columns to read, or None for all columns
+    labels : list
+        - Species or event labels to select, or None for all labels
+
+    Returns
+    ------------
+    pandas.DataFrame of the matching detections
+    """
+    if not os.path.isdir(store_path):
+        return pd.DataFrame(columns=RESULT_SCHEMA.names)
+
+    dataset = ds.dataset(store_path, format="parquet", partitioning=PARTITIONING)
+    expression = None
+    for column, value in [('date', date), ('model', model), ('site', site)]:
+        if value is not None:
+            condition = ds.field(column) == value
+            expression = condition if expression is None else expression & condition
+    if labels is not None:
+        condition = ds.field('label').isin(list(labels))
+        expression = condition if expression is None else expression & condition
+
+    return dataset.to_table(columns=columns, filter=expression).to_pandas()
+
+
+def compute_activity_cube(detections_df, resolution):
+    """
+    Aggregates detections in the normalized schema into counts per period, model, site, label and freq_group.
+
+    Parameters
+    ------------
+    detections_df : pandas.DataFrame
+        - Detections in the normalized schema
+    resolution : str
+        - A key of DAILY_RESOLUTIONS, or MONTHLY_RESOLUTION
+
+    Returns
+    ------------
+    pandas.DataFrame with the CUBE_DIMENSIONS and detection_count, confidence_sum and confidence_count
+    """
+    start_utc = pd.to_datetime(detections_df['start_utc'])
+    if resolution == MONTHLY_RESOLUTION:
+        period_start = start_utc.dt.to_period('M').dt.start_time
+    else:
+        period_start = start_utc.dt.floor(DAILY_RESOLUTIONS[resolution])
+
+    cube_df = detections_df.assign(period_start=period_start).groupby(CUBE_DIMENSIONS, dropna=False).agg(
+        detection_count=('start_utc', 'size'),
+        confidence_sum=('confidence', 'sum'),
+        confidence_count=('confidence', 'count'),
+    ).reset_index()
+
+    return cube_df
+
+
+def _merge_cubes(cube_df, resolution):
+    """Re-aggregates cube rows (e.g. day cubes of a month) at a coarser resolution."""
+    if resolution == MONTHLY_RESOLUTION:
+        cube_df = cube_df.assign(period_start=pd.to_datetime(cube_df['period_start']).dt.to_period('M').dt.start_time)
+    return cube_df.groupby(CUBE_DIMENSIONS, dropna=False)[['detection_count', 'confidence_sum', 'confidence_count']].sum().reset_index()
+
+
+def _write_cube(cube_df, cubes_path, resolution, model, period):
+    cube_dir = os.path.join(cubes_path, f"resolution={resolution}", f"model={model}", f"period={period}")
+    if cube_df.empty:
+        shutil.rmtree(cube_dir, ignore_errors=True)
+        return
+    os.makedirs(cube_dir, exist_ok=True)
+    table = pa.Table.from_pandas(cube_df.drop(columns='model'), schema=CUBE_SCHEMA, preserve_index=False)
+    tmp_path = os.path.join(cube_dir, f".cube-{uuid.uuid4().hex}.parquet")
+    pq.write_table(table, tmp_path)
+    os.replace(tmp_path, os.path.join(cube_dir, "cube.parquet"))
+
+
+def update_activity_cubes(partitions, store_path=RESULT_STORE_PATH, cubes_path=ACTIVITY_CUBES_PATH):
+    """
+    Rebuilds the activity cubes of the given dates and models, and the month cubes containing them.
+
+    Parameters
+    ------------
+    partitions : list
+        - (date, model) pairs whose detections changed
+    store_path : str
+        - The root of the Parquet dataset of detections
+    cubes_path : str
+        - The root of the activity cubes
+    """
+    for date, model in partitions:
+        detections_df = query_results(store_path, date=date, model=model)
+        for resolution in DAILY_RESOLUTIONS:
+            cube_df = compute_activity_cube(detections_df, resolution) if not detections_df.empty else pd.DataFrame()
+            _write_cube(cube_df, cubes_path, resolution, model, date)
+
+    for month, model in sorted({(date[:6], model) for date, model in partitions}):
+        day_cubes_dir = os.path.join(cubes_path, "resolution=1d", f"model={model}")
+        month_dates = [name.split('=', 1)[1] for name in os.listdir(day_cubes_dir)
+                       if name.startswith(f"period={month}")] if os.path.isdir(day_cubes_dir) else []
+        day_cube_df = query_activity('1d', model=model, periods=month_dates, cubes_path=cubes_path) if month_dates else pd.DataFrame()
+        cube_df = _merge_cubes(day_cube_df, MONTHLY_RESOLUTION) if not day_cube_df.empty else pd.DataFrame()
+        _write_cube(cube_df, cubes_path, MONTHLY_RESOLUTION, model, month)
+
+
+def query_activity(resolution, model=None, site=None, periods=None, cubes_path=ACTIVITY_CUBES_PATH):
+    """
+    Reads an activity cube, only opening the partitions that match the filters.
+
+    Parameters
+    ------------
+    resolution : str
+        - A key of DAILY_RESOLUTIONS, or MONTHLY_RESOLUTION
+    model : str
+        - Model to select, or None for all models
+    site : str
+        - Site to select, or None for all sites
+    periods : list
+        - YYYYMMDD dates (YYYYMM months for the month cube) to select, or None for all
+    cubes_path : str
+        - The root of the activity cubes
+
+    Returns
+    ------------
+    pandas.DataFrame with the CUBE_DIMENSIONS and detection_count, confidence_sum and confidence_count
+    """
+    cube_dir = os.path.join(cubes_path, f"resolution={resolution}")
+    if not os.path.isdir(cube_dir):
+        return pd.DataFrame(columns=CUBE_DIMENSIONS + ['detection_count', 'confidence_sum', 'confidence_count'])
+
+    dataset = ds.dataset(cubes_path, format="parquet", partitioning=CUBE_PARTITIONING)
+    expression = ds.field('resolution') == resolution
+    if model is not None:
+        expression = expression & (ds.field('model') == model)
+    if site is not None:
+        expression = expression & (ds.field('site') == site)
+    if periods is not None:
+        expression = expression & ds.field('period').isin(list(periods))
+
+    columns = CUBE_DIMENSIONS + ['detection_count', 'confidence_sum', 'confidence_count']
+    return dataset.to_table(columns=columns, filter=expression).to_pandas()
+
+
+def rebuild_store(store_path=RESULT_STORE_PATH):
+    """
+    Rebuilds the store from every result file in the result catalog written by move_manila_files.py.
+    """
+    catalog_path = os.path.join(MANILA_STORAGE_PATH, RESULT_CATALOG_NAME)
+    with open(catalog_path, newline='') as f:
+        entries = list(csv.DictReader(f))
+
+    result_files = []
+    for entry in entries:
+        model = get_result_model(os.path.basename(entry['path']))
+        file_path = os.path.join(MANILA_STORAGE_PATH, entry['path'])
+        if model is not None and os.path.exists(file_path):
+            result_files.append((file_path, model))
+
+    if os.path.isdir(store_path):
+        shutil.rmtree(store_path)
+    if os.path.isdir(ACTIVITY_CUBES_PATH):
+        shutil.rmtree(ACTIVITY_CUBES_PATH)
+    num_rows = append_results(result_files, store_path, ACTIVITY_CUBES_PATH)
+    print(f"Added {num_rows} detections from {len(result_files)} result files to {store_path}.")
+
+
+if __name__ == "__main__":
+    rebuild_store()
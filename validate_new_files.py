@@ -0,0 +1,130 @@
+import os
+import sys
+import csv
+import struct
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+'''
+Implementation:
+Checks every file in new_files.txt (written by new_data1.py) before any model container is started.
+Only the RIFF header of each file is read, using the same reader as bat-detect-msds/src/file_dealer.py.
+A file is rejected if it does not exist, is empty, is not a WAV file, is shorter on disk than its header says
+(truncated upload), is shorter than --min_duration (off by default, since duty cycles differ between
+deployments), or if its AudioMoth comment reports microphone or battery issues. Usable files are written to usable_files.txt and rejected files with their
+reason to rejected_files.csv. The docker_runs scripts only process the files in usable_files.txt.
+'''
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bat-detect-msds', 'src'))
+from utils.wav_header import read_wav_header
+
+new_files_path = 'new_files.txt'
+usable_files_path = 'usable_files.txt'
+rejected_files_path = 'rejected_files.csv'
+
+
+def get_rejection_reason(file_path, min_duration):
+    '''
+    Parameters
+    ------------
+    file_path : str
+        - The path to the WAV file to check
+    min_duration : float
+        - The shortest recording length in seconds that is usable; 0 accepts any length
+
+    Returns
+    ------------
+    reason the file is not usable, or None if it is usable
+    '''
+    if not os.path.exists(file_path):
+        return "Does not exist!"
+    if os.path.getsize(file_path) == 0:
+        return "Is empty!"
+
+    try:
+        header = read_wav_header(file_path)
+    except (OSError, ValueError, struct.error):
+        return "Not a WAV file"
+
+    if header["sample_rate"] is None or header["data_size"] is None:
+        return "No fmt or data chunk"
+    if header["data_offset"] + header["data_size"] > header["file_size"]:
+        return "Truncated; data chunk is longer than the file"
+    if min_duration > 0 and (header["duration"] is None or header["duration"] < min_duration):
+        return f"Too short; {header['duration']}s"
+
+    comment = header["comment"] or ""
+    if "microphone" in comment:
+        return "Not usable; microphone issues"
+    if "voltage" in comment:
+        return "Not usable; battery issues"
+
+    return None
+
+
+def validate_files(file_paths, min_duration, num_threads):
+    '''
+    Parameters
+    ------------
+    file_paths : list
+        - The paths to the WAV files to check
+    min_duration : float
+        - The shortest recording length in seconds that is usable
+    num_threads : int
+        - The number of files read at once
+
+    Returns
+    ------------
+    list of usable files, and list of (file, reason) pairs for the rejected files
+    '''
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        reasons = list(executor.map(lambda file_path : get_rejection_reason(file_path, min_duration), file_paths))
+
+    usable_files = [file_path for file_path, reason in zip(file_paths, reasons) if reason is None]
+    rejected_files = [(file_path, reason) for file_path, reason in zip(file_paths, reasons) if reason is not None]
+
+    return usable_files, rejected_files
+
+
+def parse_args():
+    """
+    Defines the command line interface for the validator.
+    """
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--min_duration",
+        type=float,
+        help="The shortest recording length in seconds that is usable, like 1795 for 30-minute cycles. "
+             "Defaults to 0, which accepts recordings of any length",
+        default=0,
+    )
+    parser.add_argument(
+        "--num_threads",
+        type=int,
+        help="The number of files read at once",
+        default=16,
+    )
+    return vars(parser.parse_args())
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    with open(new_files_path, "r") as f:
+        file_paths = [line.strip() for line in f if line.strip()]
+
+    usable_files, rejected_files = validate_files(file_paths, args["min_duration"], args["num_threads"])
+
+    with open(usable_files_path, "w") as f:
+        for file_path in usable_files:
+            f.write(f"{file_path}\n")
+
+    with open(rejected_files_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["file_path", "reason"])
+        writer.writerows(rejected_files)
+
+    print(f"{len(usable_files)} usable files, {len(rejected_files)} rejected files.")
+    for file_path, reason in rejected_files:
+        print(f"Rejected {file_path}: {reason}")